@@ -1,59 +1,91 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, send_file, session,current_app
-from models import db, Tool, User, ToolLog
+from flask import Blueprint, render_template, request, flash, redirect, url_for, session,current_app, jsonify, Response, stream_with_context
+from models import Tool, User
+from auth import get_current_user
+from api_tokens import create_api_token, list_api_tokens, revoke_api_tokens
+from page_cache import cached_fragment, conditional_page, render_fragment
+from analytics import (MAX_TOP_LIMIT, MAX_TREND_DAYS, TOP_LIMIT, TREND_DAYS, get_analytics, get_rebuild_status,
+                       get_subject_analytics, parse_bounded, start_rebuild)
+from backups import find_backup, get_backups_path, list_backups, restore_backup
+from importer import IMPORT_KINDS, import_file
+from removal import delete_tools, delete_users, parse_id_spec
+from retention import archive_history, list_archives
+from exports import EXPORT_FORMATS, parse_transaction_filters, stream_logs_export, stream_transactions_export
+from log_stream import get_latest_log_id, stream_logs
+from qr_codes import get_regeneration_status, select_tools, start_regeneration, stream_label_sheets, stream_qr_zip
+from tool_logs import get_logs_page, log_to_dict, parse_log_filters, parse_limit
 import os
-from utils import (add_tool, remove_tools, add_user, remove_users, is_admin, backup_database, 
-                   restore_database, generate_qr_codes_zip, log_lend_tool, log_return_tool, regenerate_qr_codes)
-import io
+import datetime
+import sqlite3
+from utils import add_tool, add_user, is_admin, backup_database, format_duration
 
 admin_bp = Blueprint('admin', __name__)
 
 @admin_bp.context_processor
 def utility_processor():
-    def is_admin(user_id):
-        user = db.session.get(User, user_id)
-        return user.is_admin if user else False
-    return dict(is_admin=is_admin)
+    return dict(is_admin=is_admin, current_user=get_current_user)
+
+@admin_bp.app_template_filter('duration')
+def duration_filter(seconds):
+    return format_duration(datetime.timedelta(seconds=seconds)) if seconds is not None else '-'
 
 @admin_bp.route('/admin_panel')
+@conditional_page
 def admin_panel():
     tools = Tool.query.all()
     users = User.query.all()
-    logs = ToolLog.query.order_by(ToolLog.timestamp.desc()).all()
-
-    formatted_logs = []
-    for log in logs:
-        formatted_logs.append({
-            'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'user': log.username,
-            'tool': log.tool_name,
-            'action': log.action,
-            'details': log.details if log.details else "None"
-        })
+    logs, _ = get_logs_page()
+
+    formatted_logs = [log_to_dict(log) for log in logs]
 
     return render_template('admin_panel.html', tools=tools, users=users, logs=formatted_logs)
 
 @admin_bp.route('/manage_tools')
+@conditional_page
 def manage_tools():
-    tools = Tool.query.all()
-    return render_template('manage_tools.html', tools=tools)
+    tool_list = cached_fragment('tool_list', lambda: render_fragment('_tool_list.html', tools=Tool.query.all()))
+    return render_template('manage_tools.html', tool_list=tool_list)
 
 @admin_bp.route('/manage_users')
+@conditional_page
 def manage_users():
-    users = User.query.all()
-    return render_template('manage_users.html', users=users)
+    user_list = cached_fragment('user_list', lambda: render_fragment('_user_list.html', users=User.query.all()))
+    return render_template('manage_users.html', user_list=user_list, api_tokens=list_api_tokens())
 
 @admin_bp.route('/database_management')
 def database_management():
-    return render_template('database_management.html')
+    backups = list_backups(current_app)
+    archives = [{'month': month, 'size': os.path.getsize(path)} for month, month_end, path in list_archives()]
+    return render_template('database_management.html', backups=backups,
+                           total_size=sum(backup['size'] for backup in backups), archives=archives,
+                           retention_days=current_app.config.get('LOG_RETENTION_DAYS'))
 
 @admin_bp.route('/logs')
 def logs():
-    logs = ToolLog.query.order_by(ToolLog.timestamp.desc()).all()
-    return render_template('logs.html', logs=logs)
+    try:
+        filters = parse_log_filters(request.args)
+        logs, next_cursor = get_logs_page(cursor=request.args.get('cursor'),
+                                          limit=parse_limit(request.args.get('limit')), **filters)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        logs, next_cursor = get_logs_page()
+    return render_template('logs.html', logs=logs, next_cursor=next_cursor)
+
+@admin_bp.route('/api/logs')
+def api_logs():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        return jsonify({'error': 'Admin access required'}), 403
+
+    try:
+        filters = parse_log_filters(request.args)
+        logs, next_cursor = get_logs_page(cursor=request.args.get('cursor'),
+                                          limit=parse_limit(request.args.get('limit')), **filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'logs': [log_to_dict(log) for log in logs], 'next_cursor': next_cursor})
 
 @admin_bp.route('/qr_codes')
 def qr_codes():
-    return render_template('qr_codes.html')
+    return render_template('qr_codes.html', regeneration=get_regeneration_status())
 
 @admin_bp.route('/add_tool', methods=['POST'])
 def admin_add_tool():
@@ -67,15 +99,60 @@ def admin_add_tool():
     flash('Tool added successfully', 'success')
     return redirect(url_for('admin.manage_tools'))
 
+@admin_bp.route('/import/<kind>', methods=['POST'])
+def admin_import(kind):
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
+    if kind not in IMPORT_KINDS:
+        flash(f'Unknown import: {kind}', 'danger')
+        return redirect(url_for('admin.admin_panel'))
+
+    back = url_for('admin.manage_tools' if kind == 'tools' else 'admin.manage_users')
+    upload = request.files.get('import_file')
+    if upload is None or not upload.filename:
+        flash('No file selected', 'danger')
+        return redirect(back)
+
+    dry_run = bool(request.form.get('dry_run'))
+    try:
+        report = import_file(kind, upload.filename, upload.stream, dry_run=dry_run,
+                             workers=current_app.config.get('IMPORT_HASH_WORKERS'))
+    except (ValueError, UnicodeDecodeError) as e:
+        flash(f'Import failed: {e}', 'danger')
+        return redirect(back)
+
+    qr_pending = False
+    if kind == 'tools' and report.imported and not dry_run:
+        # Labels are rendered by the background job instead of one PNG per inserted row
+        _, qr_pending = start_regeneration(current_app._get_current_object())
+    return render_template('import_report.html', report=report.to_dict(), back=back, qr_pending=qr_pending)
+
+def flash_removal(result, noun):
+    if result['removed']:
+        message = f"Removed {len(result['removed'])} {noun}(s)"
+        if result['archived_transactions']:
+            message += f", {result['archived_transactions']} loan(s) moved to the archive"
+        flash(message, 'success')
+    for blocked in result['blocked']:
+        flash(f"{noun.capitalize()} {blocked['name']} (ID {blocked['id']}) not removed: it {blocked['reason']}", 'warning')
+    if not result['removed'] and not result['blocked']:
+        flash(f'No matching {noun}s found', 'danger')
+
 @admin_bp.route('/remove_tools', methods=['POST'])
 def admin_remove_tools():
-    tool_ids = request.form.get('tool_ids')
-    if tool_ids:
-        ids = [int(id.strip()) for id in tool_ids.split(',')]
-        remove_tools(ids)
-        flash(f'Removed {len(ids)} tool(s)', 'success')
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
+
+    try:
+        ids, ranges = parse_id_spec(request.form.get('tool_ids'))
+        result = delete_tools(ids=ids, ranges=ranges, location=request.form.get('location', '').strip() or None,
+                              on_transactions=request.form.get('on_transactions', 'archive'))
+    except ValueError as e:
+        flash(str(e), 'danger')
     else:
-        flash('No tool IDs provided', 'danger')
+        flash_removal(result, 'tool')
     return redirect(url_for('admin.manage_tools'))
 
 @admin_bp.route('/add_user', methods=['POST'])
@@ -92,13 +169,45 @@ def admin_add_user():
 
 @admin_bp.route('/remove_users', methods=['POST'])
 def admin_remove_users():
-    user_ids = request.form.get('user_ids')
-    if user_ids:
-        ids = [int(id.strip()) for id in user_ids.split(',')]
-        remove_users(ids)
-        flash(f'Removed {len(ids)} user(s)', 'success')
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
+
+    try:
+        ids, ranges = parse_id_spec(request.form.get('user_ids'))
+        result = delete_users(ids=ids, ranges=ranges, on_transactions=request.form.get('on_transactions', 'archive'),
+                              keep_ids={session['user_id']})
+    except ValueError as e:
+        flash(str(e), 'danger')
+    else:
+        flash_removal(result, 'user')
+    return redirect(url_for('admin.manage_users'))
+
+@admin_bp.route('/add_api_token', methods=['POST'])
+def admin_add_api_token():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
+
+    try:
+        api_token, token = create_api_token(int(request.form['token_user_id']), request.form.get('token_name'))
+    except ValueError as e:
+        flash(str(e) or 'Invalid user ID', 'danger')
+    else:
+        # Only the hash is kept, so this is the one chance to copy it
+        flash(f"API token '{api_token.name}' created: {token} - copy it now, it is not shown again", 'success')
+    return redirect(url_for('admin.manage_users'))
+
+@admin_bp.route('/revoke_api_token/<int:token_id>', methods=['POST'])
+def admin_revoke_api_token(token_id):
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
+
+    if revoke_api_tokens(token_ids=[token_id]):
+        flash('API token revoked', 'success')
     else:
-        flash('No user IDs provided', 'danger')
+        flash('API token not found', 'danger')
     return redirect(url_for('admin.manage_users'))
 
 @admin_bp.route('/backup_database', methods=['POST'])
@@ -107,24 +216,52 @@ def admin_backup_database():
         flash('Admin access required', 'danger')
         return redirect(url_for('views.login'))
     
-    backup_database()
+    backup_database(current_app._get_current_object())
     flash('Database backup created successfully', 'success')
     return redirect(url_for('admin.database_management'))
 
+@admin_bp.route('/archive_history', methods=['POST'])
+def admin_archive_history():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
+
+    try:
+        days = int(request.form.get('older_than_days') or current_app.config.get('LOG_RETENTION_DAYS') or 0)
+        if days < 1:
+            raise ValueError
+    except ValueError:
+        flash('Enter the age in days, 1 or more', 'danger')
+        return redirect(url_for('admin.database_management'))
+
+    result = archive_history(current_app._get_current_object(), older_than_days=days)
+    flash(f"Archived {result['logs']} log entries and {result['transactions']} returned loans older than {days} days", 'success')
+    return redirect(url_for('admin.database_management'))
+
 @admin_bp.route('/restore_database', methods=['POST'])
 def admin_restore_database():
     if 'user_id' not in session or not is_admin(session['user_id']):
         flash('Admin access required', 'danger')
         return redirect(url_for('views.login'))
     
-    backup_dir = current_app.config['BACKUPS_PATH']
-    backups = sorted(os.listdir(backup_dir), reverse=True)
-    if backups:
-        latest_backup = os.path.join(backup_dir, backups[0])
-        restore_database(latest_backup)
-        flash('Database restored successfully', 'success')
-    else:
-        flash('No backup files found', 'danger')
+    app = current_app._get_current_object()
+    uploaded = request.files.get('backup_file')
+    try:
+        if uploaded and uploaded.filename:
+            extension = '.db.gz' if uploaded.filename.endswith('.gz') else '.db'
+            backup_path = os.path.join(get_backups_path(app), f"uploaded_{datetime.datetime.now():%Y%m%d%H%M%S}{extension}")
+            uploaded.save(backup_path)
+        else:
+            restore_point = request.form.get('restore_point')
+            backup_path = find_backup(app, name=request.form.get('backup_name'),
+                                      restore_point=datetime.datetime.fromisoformat(restore_point) if restore_point else None)
+        restore_backup(app, backup_path)
+        flash(f'Database restored from {os.path.basename(backup_path)}', 'success')
+    except (ValueError, OSError, sqlite3.Error) as e:
+        flash(f'Restore failed: {e}', 'danger')
+    finally:
+        if uploaded and uploaded.filename and os.path.exists(backup_path):
+            os.remove(backup_path)
     return redirect(url_for('admin.database_management'))
 
 @admin_bp.route('/download_qr_codes', methods=['GET','POST'])
@@ -132,8 +269,30 @@ def admin_download_qr_codes():
     if 'user_id' not in session or not is_admin(session['user_id']):
         return redirect(url_for('views.login'))
     
-    zip_buffer = generate_qr_codes_zip()
-    return send_file(zip_buffer, mimetype='application/zip', as_attachment=True, download_name='qr_codes.zip')
+    values = request.values
+    try:
+        filters = {
+            'location': values.get('location', '').strip() or None,
+            'id_from': int(values['id_from']) if values.get('id_from') else None,
+            'id_to': int(values['id_to']) if values.get('id_to') else None,
+        }
+        columns = int(values.get('columns') or 4)
+        rows = int(values.get('rows') or 6)
+    except ValueError:
+        flash('Tool IDs, columns and rows must be numbers', 'danger')
+        return redirect(url_for('admin.qr_codes'))
+
+    tools = select_tools(**filters)
+    if values.get('mode') == 'sheets':
+        chunks = stream_label_sheets(tools, max(1, min(columns, 10)), max(1, min(rows, 15)),
+                                     current_app.config.get('LABEL_SHEET_DPI', 300))
+        download_name = 'qr_label_sheets.zip'
+    else:
+        chunks = stream_qr_zip(tools)
+        download_name = 'qr_codes.zip'
+    response = Response(chunks, mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    return response
 
 @admin_bp.route('/regenerate_qr_codes', methods=['POST'])
 def admin_regenerate_qr_codes():
@@ -141,36 +300,148 @@ def admin_regenerate_qr_codes():
         flash('Admin access required', 'danger')
         return redirect(url_for('views.login'))
     
-    regenerate_qr_codes()
-    flash('QR codes regenerated successfully', 'success')
+    job, started = start_regeneration(current_app._get_current_object(), force=request.form.get('force') == 'on')
+    if started:
+        flash('QR code regeneration started', 'success')
+    else:
+        flash('QR code regeneration is already running', 'warning')
     return redirect(url_for('admin.qr_codes'))
 
+@admin_bp.route('/regenerate_qr_codes/status')
+def admin_regenerate_qr_codes_status():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        return jsonify({'error': 'Admin access required'}), 403
+    return jsonify(get_regeneration_status())
+
 @admin_bp.route('/live_logs')
 def admin_live_logs():
     if 'user_id' not in session or not is_admin(session['user_id']):
         flash('Admin access required', 'danger')
         return redirect(url_for('views.login'))
 
-    logs = ToolLog.query.order_by(ToolLog.timestamp.desc()).all()
-    return render_template('live_logs.html', logs=logs)
+    logs, next_cursor = get_logs_page()
+    return render_template('live_logs.html', logs=logs, next_cursor=next_cursor)
+
+@admin_bp.route('/live_logs/stream')
+def admin_live_logs_stream():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        return jsonify({'error': 'Admin access required'}), 403
+
+    # EventSource sends Last-Event-ID on reconnect; the page passes last_id on first connect
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try:
+        last_id = int(last_id) if last_id else get_latest_log_id()
+    except ValueError:
+        return jsonify({'error': f'Invalid last event id: {last_id}'}), 400
+
+    response = Response(stream_with_context(stream_logs(last_id)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def export_response(chunks, filename, export_format):
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}.{export_format}'
+    return response
 
 @admin_bp.route('/download_logs')
 def download_logs():
-    logs = ToolLog.query.order_by(ToolLog.timestamp.desc()).all()
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
+
+    export_format = request.args.get('format', 'txt')
+    try:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {export_format}")
+        filters = parse_log_filters(request.args)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('admin.logs'))
 
-    log_lines = []
-    for log in logs:
-        timestamp = log.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        user = log.username
-        tool = log.tool_name
-        action = log.action
-        details = log.details if log.details else "None"
-        log_lines.append(f"{timestamp} - {user} - {tool} - Action: {action} - Details: {details}")
+    return export_response(stream_logs_export(export_format, **filters), 'logs', export_format)
 
-    log_content = "\n".join(log_lines)
+@admin_bp.route('/download_transactions')
+def download_transactions():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
 
-    buffer = io.BytesIO()
-    buffer.write(log_content.encode('utf-8'))
-    buffer.seek(0)
+    export_format = request.args.get('format', 'txt')
+    try:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {export_format}")
+        filters = parse_transaction_filters(request.args)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('admin.logs'))
 
-    return send_file(buffer, as_attachment=True, download_name='logs.txt', mimetype='text/plain')
+    return export_response(stream_transactions_export(export_format, **filters), 'transactions', export_format)
+
+def analytics_options(args):
+    return {
+        'days': parse_bounded(args.get('days'), TREND_DAYS, MAX_TREND_DAYS),
+        'loan_period_days': parse_bounded(args.get('loan_period_days'),
+                                          current_app.config.get('LOAN_PERIOD_DAYS', 14), MAX_TREND_DAYS),
+    }
+
+@admin_bp.route('/analytics')
+def analytics():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
+
+    try:
+        options = analytics_options(request.args)
+        limit = parse_bounded(request.args.get('limit'), TOP_LIMIT, MAX_TOP_LIMIT)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        options, limit = analytics_options({}), TOP_LIMIT
+    return render_template('analytics.html', stats=get_analytics(limit=limit, **options), rebuild=get_rebuild_status())
+
+@admin_bp.route('/api/analytics')
+def api_analytics():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        return jsonify({'error': 'Admin access required'}), 403
+
+    try:
+        options = analytics_options(request.args)
+        limit = parse_bounded(request.args.get('limit'), TOP_LIMIT, MAX_TOP_LIMIT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(get_analytics(limit=limit, **options))
+
+@admin_bp.route('/api/analytics/<kind>/<int:subject_id>')
+def api_subject_analytics(kind, subject_id):
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        return jsonify({'error': 'Admin access required'}), 403
+    if kind not in ('tools', 'users'):
+        return jsonify({'error': f'Unknown kind: {kind}'}), 404
+
+    try:
+        options = analytics_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    stats = get_subject_analytics(kind[:-1], subject_id, **options)
+    if stats is None:
+        return jsonify({'error': f'No {kind[:-1]} with id {subject_id}'}), 404
+    return jsonify(stats)
+
+@admin_bp.route('/rebuild_analytics', methods=['POST'])
+def admin_rebuild_analytics():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        flash('Admin access required', 'danger')
+        return redirect(url_for('views.login'))
+
+    job, started = start_rebuild(current_app._get_current_object())
+    if started:
+        flash('Usage statistics rebuild started', 'success')
+    else:
+        flash('Usage statistics rebuild is already running', 'warning')
+    return redirect(url_for('admin.analytics'))
+
+@admin_bp.route('/rebuild_analytics/status')
+def admin_rebuild_analytics_status():
+    if 'user_id' not in session or not is_admin(session['user_id']):
+        return jsonify({'error': 'Admin access required'}), 403
+    return jsonify(get_rebuild_status())
@@ -0,0 +1,447 @@
+import datetime
+import threading
+from collections import Counter, namedtuple
+from sqlalchemy import MetaData, cast, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as upsert
+from models import (db, Tool, User, Transaction, TransactionArchive,
+                    UsageTotal, UsageDuration, UsageHourly, UsageDaily)
+from availability import get_open_loans
+from page_cache import bump_data_version
+from retention import get_archive_engine, history_lock, list_archives, naive_utc
+
+LOAN_PERIOD_DAYS = 14
+TOP_LIMIT = 20
+MAX_TOP_LIMIT = 200
+TREND_DAYS = 30
+MAX_TREND_DAYS = 366
+# Unix epoch as a Julian day number, for turning SQLite dates into seconds
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+ROLLUP_MODELS = (UsageTotal, UsageDuration, UsageHourly, UsageDaily)
+REBUILD_BATCH_SIZE = 20000
+# A return takes its timestamp before it commits, so the rebuild watermark sits well behind its snapshot
+REBUILD_WATERMARK_MARGIN = datetime.timedelta(minutes=10)
+
+Loan = namedtuple('Loan', ['tool_id', 'user_id', 'borrow_date', 'return_date', 'duration_seconds'])
+
+
+def duration_bucket(seconds):
+    # Bucket b holds loans of 2**b up to 2**(b+1) seconds; anything under two seconds is bucket 0
+    return max(int(seconds), 1).bit_length() - 1
+
+
+def loan_subjects(loan):
+    return (('tool', loan.tool_id), ('user', loan.user_id), ('all', 0))
+
+
+def rollup_loans(loans):
+    totals, durations, hourly, daily = {}, Counter(), Counter(), {}
+    for loan in loans:
+        borrow_date, return_date = naive_utc(loan.borrow_date), naive_utc(loan.return_date)
+        seconds = max(int(loan.duration_seconds), 0)
+        for key in loan_subjects(loan):
+            total = totals.setdefault(key, [0, 0, 0, return_date])
+            total[0] += 1
+            total[1] += seconds
+            total[2] = max(total[2], seconds)
+            total[3] = max(total[3], return_date)
+            durations[key + (duration_bucket(seconds),)] += 1
+            hourly[key + (borrow_date.hour,)] += 1
+            day = daily.setdefault(key + (borrow_date.date(),), [0, 0])
+            day[0] += 1
+            day[1] += seconds
+
+    return {
+        UsageTotal: [{'kind': kind, 'subject_id': subject_id, 'loans': count, 'total_seconds': seconds,
+                      'max_seconds': longest, 'last_returned_at': last}
+                     for (kind, subject_id), (count, seconds, longest, last) in totals.items()],
+        UsageDuration: [{'kind': kind, 'subject_id': subject_id, 'bucket': bucket, 'loans': count}
+                        for (kind, subject_id, bucket), count in durations.items()],
+        UsageHourly: [{'kind': kind, 'subject_id': subject_id, 'hour': hour, 'loans': count}
+                      for (kind, subject_id, hour), count in hourly.items()],
+        UsageDaily: [{'kind': kind, 'subject_id': subject_id, 'day': day, 'loans': count, 'total_seconds': seconds}
+                     for (kind, subject_id, day), (count, seconds) in daily.items()],
+    }
+
+
+def upsert_rollup(model, rows, table=None, connection=None):
+    if not rows:
+        return
+    table = model.__table__ if table is None else table
+    statement = upsert(table)
+    excluded, columns = statement.excluded, table.c
+    updates = {'loans': columns.loans + excluded.loans}
+    if model is UsageTotal:
+        updates['total_seconds'] = columns.total_seconds + excluded.total_seconds
+        updates['max_seconds'] = func.max(columns.max_seconds, excluded.max_seconds)
+        updates['last_returned_at'] = func.max(func.coalesce(columns.last_returned_at, excluded.last_returned_at),
+                                               excluded.last_returned_at)
+    elif model is UsageDaily:
+        updates['total_seconds'] = columns.total_seconds + excluded.total_seconds
+    keys = [column.name for column in table.primary_key.columns]
+    (connection or db.session).execute(statement.on_conflict_do_update(index_elements=keys, set_=updates), rows)
+
+
+def record_returns(loans):
+    # Runs inside the caller's transaction, so the rollups commit together with the returns
+    for model, rows in rollup_loans(loans).items():
+        upsert_rollup(model, rows)
+
+
+def epoch_seconds(column):
+    return (func.julianday(column) - UNIX_EPOCH_JULIAN_DAY) * 86400.0
+
+
+def closed_loan_statements():
+    yield select(Transaction.tool_id, Transaction.user_id,
+                 epoch_seconds(Transaction.borrow_date), epoch_seconds(Transaction.return_date)) \
+        .where(Transaction.return_date.isnot(None))
+    # Loans of removed tools and users, and the ones retention moved to monthly files, count as well
+    yield select(TransactionArchive.tool_id, TransactionArchive.user_id,
+                 epoch_seconds(TransactionArchive.borrow_date), epoch_seconds(TransactionArchive.return_date)) \
+        .where(TransactionArchive.return_date.isnot(None))
+
+
+def recent_return_statements(watermark):
+    for model in (Transaction, TransactionArchive):
+        yield select(model.tool_id, model.user_id, model.borrow_date, model.return_date) \
+            .where(model.return_date >= watermark)
+
+
+def load_recent_returns(connection, watermark):
+    loans = []
+    for statement in recent_return_statements(watermark):
+        for tool_id, user_id, borrow_date, return_date in connection.execute(statement):
+            loans.append(Loan(tool_id, user_id, borrow_date, return_date,
+                              round((return_date - borrow_date).total_seconds())))
+    return loans
+
+
+def loan_key(loan):
+    # Removal copies a loan into the archive table under a new id, so loans are matched on what they were
+    return loan.tool_id, loan.user_id, loan.borrow_date
+
+
+def load_loan_array(connection, app=None):
+    import numpy as np
+    hot, archived = closed_loan_statements()
+    parts = [connection.execute(hot).all(), connection.execute(archived).all()]
+    for month, month_end, path in list_archives(app):
+        with get_archive_engine(path).connect() as archive:
+            parts.append(archive.execute(archived).all())
+    rows = [row for part in parts for row in part]
+    return np.array(rows, dtype=np.float64).reshape(-1, 4)
+
+
+def group_rows(np, keys, seconds=None):
+    # One row per distinct key tuple, with the loan count (and summed seconds) for each
+    unique, inverse, counts = np.unique(np.stack(keys, axis=1), axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    sums = np.bincount(inverse, weights=seconds, minlength=len(unique)) if seconds is not None else None
+    return unique, inverse, counts, sums
+
+
+def aggregate_loans(loans):
+    import numpy as np
+    tool_ids = loans[:, 0].astype(np.int64)
+    user_ids = loans[:, 1].astype(np.int64)
+    borrowed = loans[:, 2]
+    returned = loans[:, 3]
+    seconds = np.maximum(np.rint(returned - borrowed), 0).astype(np.int64)
+    buckets = np.floor(np.log2(np.maximum(seconds, 1))).astype(np.int64)
+    hours = (borrowed // 3600 % 24).astype(np.int64)
+    days = (borrowed // 86400).astype(np.int64)
+    epoch = datetime.datetime(1970, 1, 1)
+
+    rows = {UsageTotal: [], UsageDuration: [], UsageHourly: [], UsageDaily: []}
+    for kind, subject_ids in (('tool', tool_ids), ('user', user_ids), ('all', np.zeros_like(tool_ids))):
+        unique, inverse, counts, sums = group_rows(np, [subject_ids], seconds)
+        longest = np.zeros(len(unique), dtype=np.int64)
+        np.maximum.at(longest, inverse, seconds)
+        last = np.full(len(unique), -np.inf)
+        np.maximum.at(last, inverse, returned)
+        rows[UsageTotal] += [{'kind': kind, 'subject_id': int(key[0]), 'loans': int(count),
+                              'total_seconds': int(total), 'max_seconds': int(maximum),
+                              'last_returned_at': epoch + datetime.timedelta(seconds=float(latest))}
+                             for key, count, total, maximum, latest in zip(unique, counts, sums, longest, last)]
+
+        unique, inverse, counts, sums = group_rows(np, [subject_ids, buckets])
+        rows[UsageDuration] += [{'kind': kind, 'subject_id': int(key[0]), 'bucket': int(key[1]), 'loans': int(count)}
+                                for key, count in zip(unique, counts)]
+
+        unique, inverse, counts, sums = group_rows(np, [subject_ids, hours])
+        rows[UsageHourly] += [{'kind': kind, 'subject_id': int(key[0]), 'hour': int(key[1]), 'loans': int(count)}
+                              for key, count in zip(unique, counts)]
+
+        unique, inverse, counts, sums = group_rows(np, [subject_ids, days], seconds)
+        rows[UsageDaily] += [{'kind': kind, 'subject_id': int(key[0]),
+                              'day': (epoch + datetime.timedelta(days=int(key[1]))).date(),
+                              'loans': int(count), 'total_seconds': int(total)}
+                             for key, count, total in zip(unique, counts, sums)]
+    return rows
+
+
+def fill_missing_durations():
+    db.session.execute(Transaction.__table__.update()
+                       .where(Transaction.return_date.isnot(None), Transaction.duration_seconds.is_(None))
+                       .values(duration_seconds=cast(func.round(
+                           epoch_seconds(Transaction.return_date) - epoch_seconds(Transaction.borrow_date)),
+                           db.Integer)))
+    db.session.commit()
+
+
+def staging_tables():
+    metadata = MetaData()
+    return {model: model.__table__.to_metadata(metadata, name=f'{model.__tablename__}_rebuild')
+            for model in ROLLUP_MODELS}
+
+
+def read_loans(app=None):
+    watermark = naive_utc(datetime.datetime.now(datetime.timezone.utc)) - REBUILD_WATERMARK_MARGIN
+    with db.engine.connect() as connection:
+        # One read transaction is one WAL snapshot, and it does not stand in the way of any writer
+        connection.exec_driver_sql('BEGIN')
+        try:
+            loans = load_loan_array(connection, app)
+            seen = {loan_key(loan) for loan in load_recent_returns(connection, watermark)}
+        finally:
+            connection.rollback()
+    return loans, watermark, seen
+
+
+def write_staging(tables, rows):
+    with db.engine.connect() as connection:
+        for model, table in tables.items():
+            table.drop(connection, checkfirst=True)
+            table.create(connection)
+            connection.commit()
+            # Short transactions, so returns keep getting the write lock in between
+            for start in range(0, len(rows[model]), REBUILD_BATCH_SIZE):
+                connection.execute(insert(table), rows[model][start:start + REBUILD_BATCH_SIZE])
+                connection.commit()
+
+
+def swap_rollups(tables, watermark, seen):
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        try:
+            # Returns that committed after the snapshot went into the old tables; add them to the new ones
+            late = [loan for loan in load_recent_returns(connection, watermark) if loan_key(loan) not in seen]
+            for model, rows in rollup_loans(late).items():
+                upsert_rollup(model, rows, tables[model], connection)
+            for model, table in tables.items():
+                model.__table__.drop(connection)
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} RENAME TO {model.__tablename__}')
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+    # Plain connection commits are not seen by the session's after_commit
+    bump_data_version()
+    return len(late)
+
+
+def rebuild_usage_rollups(app=None, report=None):
+    report = report or (lambda **progress: None)
+    fill_missing_durations()
+    tables = staging_tables()
+    # Retention moving loans into monthly files mid-read would count them twice or not at all
+    with history_lock:
+        report(step='reading')
+        loans, watermark, seen = read_loans(app)
+        rows = aggregate_loans(loans) if len(loans) else {model: [] for model in ROLLUP_MODELS}
+        report(step='writing', loans=len(loans))
+        write_staging(tables, rows)
+        report(step='swapping')
+        total = len(loans) + swap_rollups(tables, watermark, seen)
+    print(f"Usage statistics rebuilt from {total} returned loan(s).")
+    return total
+
+
+class RollupRebuildJob(threading.Thread):
+    def __init__(self, app):
+        super().__init__(name='usage-rebuild', daemon=True)
+        self.app = app
+        self.lock = threading.Lock()
+        self.progress = {
+            'state': 'pending',
+            'step': None,
+            'loans': 0,
+            'started': None,
+            'finished': None,
+            'error': None,
+        }
+
+    def status(self):
+        with self.lock:
+            return dict(self.progress)
+
+    def update_progress(self, **changes):
+        with self.lock:
+            self.progress.update(changes)
+
+    def run(self):
+        self.update_progress(state='running', started=datetime.datetime.now())
+        try:
+            with self.app.app_context():
+                loans = rebuild_usage_rollups(self.app, self.update_progress)
+            self.update_progress(state='finished', loans=loans)
+        except Exception as e:
+            self.update_progress(state='failed', error=str(e))
+            raise
+        finally:
+            self.update_progress(finished=datetime.datetime.now())
+
+
+_job = None
+_job_lock = threading.Lock()
+
+
+def start_rebuild(app):
+    global _job
+    with _job_lock:
+        if _job is not None and _job.is_alive():
+            return _job, False
+        _job = RollupRebuildJob(app)
+        _job.start()
+        return _job, True
+
+
+def get_rebuild_status():
+    return _job.status() if _job is not None else None
+
+
+def rollups_missing():
+    return db.session.query(UsageTotal.kind).first() is None and \
+        db.session.query(Transaction.id).filter(Transaction.return_date.isnot(None)).first() is not None
+
+
+def start_rollup_backfill(app):
+    with app.app_context():
+        if not rollups_missing():
+            return None
+    return start_rebuild(app)[0]
+
+
+def median_from_buckets(buckets):
+    total = sum(buckets.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in sorted(buckets):
+        count = buckets[bucket]
+        if seen + count >= total / 2:
+            # Loans are spread evenly on a log scale within the bucket
+            return int(round(2 ** (bucket + (total / 2 - seen) / count)))
+        seen += count
+
+
+def load_medians(kind, subject_ids):
+    buckets = {}
+    rows = db.session.query(UsageDuration.subject_id, UsageDuration.bucket, UsageDuration.loans) \
+        .filter(UsageDuration.kind == kind, UsageDuration.subject_id.in_(subject_ids))
+    for subject_id, bucket, loans in rows:
+        buckets.setdefault(subject_id, {})[bucket] = loans
+    return {subject_id: median_from_buckets(subject_buckets) for subject_id, subject_buckets in buckets.items()}
+
+
+def usage_row(total, median, name):
+    return {
+        'id': total.subject_id,
+        'name': name,
+        'loans': total.loans,
+        'total_seconds': total.total_seconds,
+        'average_seconds': total.total_seconds // total.loans if total.loans else None,
+        'median_seconds': median,
+        'max_seconds': total.max_seconds,
+        'last_returned_at': total.last_returned_at.strftime('%Y-%m-%d %H:%M:%S') if total.last_returned_at else None,
+    }
+
+
+def top_subjects(kind, model, name_column, limit=TOP_LIMIT, subject_id=None):
+    query = db.session.query(UsageTotal, name_column) \
+        .join(model, model.id == UsageTotal.subject_id) \
+        .filter(UsageTotal.kind == kind)
+    if subject_id is not None:
+        query = query.filter(UsageTotal.subject_id == subject_id)
+    rows = query.order_by(UsageTotal.loans.desc(), UsageTotal.subject_id).limit(limit).all()
+    medians = load_medians(kind, [total.subject_id for total, name in rows])
+    return [usage_row(total, medians.get(total.subject_id), name) for total, name in rows]
+
+
+def peak_hours(kind='all', subject_id=0):
+    loans = dict(db.session.query(UsageHourly.hour, UsageHourly.loans)
+                 .filter(UsageHourly.kind == kind, UsageHourly.subject_id == subject_id))
+    return [{'hour': hour, 'loans': loans.get(hour, 0)} for hour in range(24)]
+
+
+def daily_trend(days=TREND_DAYS, kind='all', subject_id=0, today=None):
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    first = today - datetime.timedelta(days=days - 1)
+    rows = {day: (loans, seconds) for day, loans, seconds in
+            db.session.query(UsageDaily.day, UsageDaily.loans, UsageDaily.total_seconds)
+            .filter(UsageDaily.kind == kind, UsageDaily.subject_id == subject_id, UsageDaily.day >= first)}
+    trend = []
+    for offset in range(days):
+        day = first + datetime.timedelta(days=offset)
+        loans, seconds = rows.get(day, (0, 0))
+        trend.append({'day': day.isoformat(), 'loans': loans, 'total_seconds': seconds})
+    return trend
+
+
+def overdue_loans(loan_period_days=LOAN_PERIOD_DAYS, now=None, kind='all', subject_id=0):
+    now = naive_utc(now or datetime.datetime.now(datetime.timezone.utc))
+    cutoff = now - datetime.timedelta(days=loan_period_days)
+    # Open loans come from the in-process snapshot, not from the database
+    return [{'tool_id': loan.tool_id, 'tool': loan.tool_name, 'user_id': loan.user_id, 'user': loan.username,
+             'borrow_date': loan.borrow_date.strftime('%Y-%m-%d %H:%M:%S'),
+             'days_out': (now - naive_utc(loan.borrow_date)).days}
+            for loan in get_open_loans()
+            if naive_utc(loan.borrow_date) < cutoff
+            and (kind == 'all' or (loan.tool_id if kind == 'tool' else loan.user_id) == subject_id)]
+
+
+def summary(kind='all', subject_id=0):
+    total = db.session.get(UsageTotal, (kind, subject_id))
+    median = load_medians(kind, [subject_id]).get(subject_id)
+    if total is None:
+        return {'loans': 0, 'total_seconds': 0, 'average_seconds': None, 'median_seconds': None,
+                'max_seconds': None, 'last_returned_at': None}
+    row = usage_row(total, median, None)
+    del row['id'], row['name']
+    return row
+
+
+def parse_bounded(value, default, maximum):
+    try:
+        number = int(value) if value else default
+    except ValueError:
+        raise ValueError(f"Not a number: {value}")
+    return max(1, min(number, maximum))
+
+
+def get_analytics(limit=TOP_LIMIT, days=TREND_DAYS, loan_period_days=LOAN_PERIOD_DAYS):
+    return {
+        'summary': summary(),
+        'peak_hours': peak_hours(),
+        'daily': daily_trend(days),
+        'tools': top_subjects('tool', Tool, Tool.name, limit),
+        'users': top_subjects('user', User, User.username, limit),
+        'overdue': overdue_loans(loan_period_days),
+        'loan_period_days': loan_period_days,
+    }
+
+
+def get_subject_analytics(kind, subject_id, days=TREND_DAYS, loan_period_days=LOAN_PERIOD_DAYS):
+    model, name_column = (Tool, Tool.name) if kind == 'tool' else (User, User.username)
+    name = db.session.query(name_column).filter(model.id == subject_id).scalar()
+    if name is None:
+        return None
+    return {
+        'id': subject_id,
+        'name': name,
+        'summary': summary(kind, subject_id),
+        'peak_hours': peak_hours(kind, subject_id),
+        'daily': daily_trend(days, kind, subject_id),
+        'overdue': overdue_loans(loan_period_days, kind=kind, subject_id=subject_id),
+        'loan_period_days': loan_period_days,
+    }
@@ -0,0 +1,264 @@
+import datetime
+import hashlib
+import threading
+import time
+from functools import wraps
+from flask import Blueprint, current_app, g, jsonify, make_response, request
+from sqlalchemy import and_, delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from models import db, IdempotencyKey, Tool, Transaction, User
+from auth import get_current_user
+from api_tokens import authenticate_token
+from lending import checkout_tools, checkin_tools
+from page_cache import conditional_page
+from qr_scan import scan_codes, scan_uploads
+from tool_search import tool_to_dict
+
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MAX_BATCH_SIZE = 500
+MAX_KEY_LENGTH = 128
+IDEMPOTENCY_KEY_HOURS = 24
+IDEMPOTENCY_LEASE_SECONDS = 60
+KEY_PURGE_INTERVAL = 600
+SCAN_ACTIONS = ('lend', 'return')
+
+_last_key_purge = 0
+_key_purge_lock = threading.Lock()
+
+
+def api_error(message, status):
+    return jsonify({'error': message}), status
+
+
+def get_api_user():
+    if 'api_user' not in g:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer':
+            g.api_user = authenticate_token(token.strip())
+        else:
+            # The browser scanner runs inside a logged-in page
+            g.api_user = get_current_user()
+    return g.api_user
+
+
+@api_bp.before_request
+def require_api_user():
+    if get_api_user() is None:
+        return api_error('A valid API token or login is required', 401)
+
+
+def read_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ValueError('Expected a JSON object')
+    return body
+
+
+def body_list(body, single, plural):
+    # {"tool_id": 5} for one scan, {"tool_ids": [5, 6]} for a batch
+    if body.get(plural) is not None:
+        values = body[plural]
+        if not isinstance(values, list):
+            raise ValueError(f"'{plural}' must be a list")
+        return values
+    return [body[single]] if body.get(single) is not None else []
+
+
+def requested_codes(body, limit=MAX_BATCH_SIZE):
+    codes = body_list(body, 'code', 'codes')
+    if len(codes) > limit:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} tools per request")
+    if any(not isinstance(code, str) for code in codes):
+        raise ValueError('Codes must be strings')
+    return codes
+
+
+def requested_tools(body):
+    tool_ids = body_list(body, 'tool_id', 'tool_ids')
+    if any(isinstance(value, bool) or not isinstance(value, int) for value in tool_ids):
+        raise ValueError('Tool ids must be integers')
+    codes = requested_codes(body, MAX_BATCH_SIZE - len(tool_ids))
+    if not tool_ids and not codes:
+        raise ValueError("Send 'tool_id', 'tool_ids', 'code' or 'codes'")
+
+    scans, scanned_ids = scan_codes(codes) if codes else ([], [])
+    return tool_ids + scanned_ids, scans
+
+
+def batch_response(results, scans=None, key='results'):
+    response = {
+        key: results,
+        'succeeded': sum(result['category'] == 'success' for result in results),
+        'failed': sum(result['category'] != 'success' for result in results),
+    }
+    if scans:
+        # Codes that did not resolve to a tool only show up here
+        response['scans'] = scans
+    return response
+
+
+def purge_expired_keys():
+    global _last_key_purge
+    now = time.monotonic()
+    with _key_purge_lock:
+        if now - _last_key_purge < KEY_PURGE_INTERVAL:
+            return
+        _last_key_purge = now
+    hours = current_app.config.get('IDEMPOTENCY_KEY_HOURS', IDEMPOTENCY_KEY_HOURS)
+    cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(hours=hours)
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+
+
+def reserve_key(user_id, key, request_hash):
+    purge_expired_keys()
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    try:
+        # The primary key makes this the lock: of two retries racing, only one gets to run
+        db.session.execute(insert(IdempotencyKey).values(
+            user_id=user_id, key=key, endpoint=request.endpoint, request_hash=request_hash, created_at=now))
+        db.session.commit()
+        return None
+    except IntegrityError:
+        db.session.rollback()
+
+    # A reservation never answered is from a request that crashed; the first retry after the lease runs again
+    lease = datetime.timedelta(seconds=current_app.config.get('IDEMPOTENCY_LEASE_SECONDS', IDEMPOTENCY_LEASE_SECONDS))
+    taken = db.session.execute(update(IdempotencyKey)
+                               .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key,
+                                      IdempotencyKey.endpoint == request.endpoint,
+                                      IdempotencyKey.request_hash == request_hash,
+                                      IdempotencyKey.status_code.is_(None), IdempotencyKey.created_at < now - lease)
+                               .values(created_at=now)).rowcount
+    db.session.commit()
+    if taken:
+        return None
+    return db.session.get(IdempotencyKey, (user_id, key))
+
+
+def finish_key(user_id, key, response):
+    condition = and_(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+    if response.status_code >= 500:
+        # Nothing was done, so a retry should run again rather than replay the failure
+        db.session.execute(delete(IdempotencyKey).where(condition))
+    else:
+        db.session.execute(update(IdempotencyKey).where(condition)
+                           .values(status_code=response.status_code, response=response.get_data(as_text=True)))
+    db.session.commit()
+
+
+def idempotent(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return api_error(f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters", 400)
+
+        user_id = get_api_user().id
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        stored = reserve_key(user_id, key, request_hash)
+        if stored is not None:
+            if stored.endpoint != request.endpoint or stored.request_hash != request_hash:
+                return api_error('Idempotency-Key was already used for a different request', 422)
+            if stored.status_code is None:
+                return api_error('A request with this Idempotency-Key is still being processed', 409)
+            response = current_app.response_class(stored.response, status=stored.status_code,
+                                                  mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            finish_key(user_id, key, current_app.response_class(status=500))
+            raise
+        finish_key(user_id, key, response)
+        return response
+    return wrapper
+
+
+@api_bp.route('/checkout', methods=['POST'])
+@idempotent
+def checkout():
+    user = get_api_user()
+    try:
+        body = read_body()
+        tool_ids, scans = requested_tools(body)
+    except ValueError as e:
+        return api_error(str(e), 400)
+
+    # Kiosks log in with an admin token and lend on behalf of whoever is in front of them
+    user_id = body.get('user_id', user.id)
+    if isinstance(user_id, bool) or not isinstance(user_id, int):
+        return api_error('user_id must be an integer', 400)
+    if user_id != user.id and not user.is_admin:
+        return api_error('Only admin tokens can lend to another user', 403)
+    return jsonify(batch_response(checkout_tools(user_id, tool_ids), scans))
+
+
+@api_bp.route('/checkin', methods=['POST'])
+@idempotent
+def checkin():
+    try:
+        tool_ids, scans = requested_tools(read_body())
+    except ValueError as e:
+        return api_error(str(e), 400)
+    return jsonify(batch_response(checkin_tools(tool_ids), scans))
+
+
+@api_bp.route('/tools/<int:tool_id>')
+@conditional_page
+def tool_detail(tool_id):
+    # One indexed lookup; the open-loans snapshot would reload every loan after each lend
+    row = db.session.query(Tool, Transaction.user_id, User.username, Transaction.borrow_date) \
+        .outerjoin(Transaction, and_(Transaction.tool_id == Tool.id, Transaction.return_date.is_(None))) \
+        .outerjoin(User, Transaction.user_id == User.id) \
+        .filter(Tool.id == tool_id) \
+        .first()
+    if row is None:
+        return api_error('Tool not found', 404)
+    tool, user_id, username, borrow_date = row
+    data = tool_to_dict(tool)
+    data['loan'] = None if borrow_date is None else {
+        'user_id': user_id,
+        'username': username,
+        'borrow_date': borrow_date.isoformat(),
+    }
+    return jsonify(data)
+
+
+@api_bp.route('/scan', methods=['POST'])
+@idempotent
+def scan():
+    user = get_api_user()
+    try:
+        if request.files:
+            # Photos, like the form upload on the lend and return pages
+            action = request.form.get('action') or None
+        else:
+            body = read_body()
+            action = body.get('action')
+            codes = requested_codes(body)
+            if not codes:
+                raise ValueError("Send 'code' or 'codes'")
+        if action is not None and action not in SCAN_ACTIONS:
+            raise ValueError(f"Unknown action: {action}")
+
+        if request.files:
+            results, tool_ids = scan_uploads(request.files.getlist('qr_images'),
+                                             current_app.config.get('QR_DECODE_WORKERS'),
+                                             current_app.config.get('QR_MAX_DIMENSION', 1600))
+        else:
+            results, tool_ids = scan_codes(codes)
+    except (ValueError, OSError) as e:
+        return api_error(str(e), 400)
+
+    response = {'results': results, 'tool_ids': tool_ids}
+    if action == 'lend':
+        response.update(batch_response(checkout_tools(user.id, tool_ids), key='outcomes'))
+    elif action == 'return':
+        response.update(batch_response(checkin_tools(tool_ids), key='outcomes'))
+    return jsonify(response)
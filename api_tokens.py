@@ -0,0 +1,85 @@
+import datetime
+import hashlib
+import secrets
+import threading
+import time
+from sqlalchemy import delete, update
+from models import db, ApiToken, User
+from auth import role_cache
+
+TOKEN_PREFIX = 'tt_'
+TOKEN_CACHE_TTL = 60
+
+
+def hash_token(token):
+    # The tokens are long and random, so a plain digest is enough; a password hash would cost every request
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    def __init__(self, ttl=TOKEN_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, token_hash):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(token_hash)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        row = db.session.query(ApiToken.id, ApiToken.user_id).filter(ApiToken.token_hash == token_hash).first()
+        user_id = row.user_id if row else None
+        if row is not None:
+            # Written once per cache period rather than on every request
+            db.session.execute(update(ApiToken).where(ApiToken.id == row.id)
+                               .values(last_used_at=datetime.datetime.now(datetime.timezone.utc)))
+            db.session.commit()
+        with self.lock:
+            self.entries[token_hash] = (now + self.ttl, user_id)
+        return user_id
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def authenticate_token(token):
+    if not token:
+        return None
+    user_id = token_cache.get(hash_token(token))
+    # role_cache answers None for removed accounts, so their tokens stop working too
+    return role_cache.get(user_id) if user_id is not None else None
+
+
+def create_api_token(user_id, name):
+    if db.session.get(User, user_id) is None:
+        raise ValueError(f"User ID {user_id} not found.")
+    name = (name or '').strip() or 'scanner'
+    token = TOKEN_PREFIX + secrets.token_urlsafe(32)
+    api_token = ApiToken(user_id=user_id, name=name[:80], token_hash=hash_token(token))
+    db.session.add(api_token)
+    db.session.commit()
+    return api_token, token
+
+
+def revoke_api_tokens(token_ids=(), user_ids=()):
+    if not token_ids and not user_ids:
+        return 0
+    condition = ApiToken.id.in_(token_ids) if token_ids else ApiToken.user_id.in_(user_ids)
+    revoked = db.session.execute(delete(ApiToken).where(condition)).rowcount
+    db.session.commit()
+    token_cache.clear()
+    return revoked
+
+
+def list_api_tokens():
+    return db.session.query(ApiToken.id, ApiToken.name, ApiToken.created_at, ApiToken.last_used_at,
+                            User.id.label('user_id'), User.username) \
+        .outerjoin(User, ApiToken.user_id == User.id) \
+        .order_by(ApiToken.id) \
+        .all()
@@ -1,9 +1,11 @@
-from config import create_app,get_self_ip
+from config import create_app,get_self_ip,start_background_task
+from server import create_server, serve
 import utils
-import time
+from workers import shutdown_process_pools
+import argparse
 import threading
 import os
-import logging
+import multiprocessing
 
 
 def run_console(app):
@@ -18,6 +20,7 @@ def run_console(app):
                 print("5. Remove User")
                 print("6. List Users")
                 print("7. Identify Tool")
+                print("8. Identify Tools from Images (folder or zip)")
                 print("10. Add Test Data")
                 print("11. Regenerate QR Codes")
                 print("12. Backup Database")
@@ -25,6 +28,11 @@ def run_console(app):
                 print("14. Add Admin")
                 print("15. Exit")
                 print("16. Reset Items")
+                print("17. Import Tools or Users from CSV/XLSX")
+                print("18. Archive Old History")
+                print("19. Reconcile Tool Availability")
+                print("20. Rebuild Usage Statistics")
+                print("21. Create API Token")
                 choice = input("Enter your choice: ")
 
                 if choice == '1':
@@ -50,10 +58,14 @@ def run_console(app):
                     file_path = os.path.join(app.config['QR_CODES_PATH'], filename)
                     print(f"Reading QR code from: {file_path}")
                     utils.identify_tool_from_qr_code(file_path)
+                elif choice == '8':
+                    paths = input("Enter image, zip or folder path(s), separated by ';': ")
+                    utils.identify_tools_from_images([path.strip() for path in paths.split(';') if path.strip()])
                 elif choice == '10':
                     utils.add_test_data()
                 elif choice == '11':
-                    utils.regenerate_qr_codes()
+                    force = input("Re-key every label with a new token? (yes/no): ").strip().lower() == 'yes'
+                    utils.regenerate_qr_codes(force=force)
                 elif choice == '12':
                     utils.backup_database(app)
                 elif choice == '13':
@@ -65,34 +77,81 @@ def run_console(app):
                     password = input("Enter admin password: ")
                     utils.add_user(username, password, is_admin=True)
                 elif choice == '15':
-                    utils.shutdown_server()
                     break
                 elif choice == '16':
                     utils.reset_rented_items()
+                elif choice == '17':
+                    kind = input("Import tools or users? (tools/users): ").strip().lower()
+                    path = input("Enter the CSV or XLSX file path: ").strip()
+                    dry_run = input("Only validate, without importing? (yes/no): ").strip().lower() == 'yes'
+                    try:
+                        utils.import_from_file(kind, path, dry_run=dry_run)
+                    except (ValueError, OSError, UnicodeDecodeError) as e:
+                        print(f"Import failed: {e}")
+                elif choice == '18':
+                    days = input(f"Archive history older than how many days? [{app.config.get('LOG_RETENTION_DAYS')}]: ").strip()
+                    utils.archive_old_history(app, int(days) if days else None)
+                elif choice == '19':
+                    utils.reconcile_tool_availability()
+                elif choice == '20':
+                    utils.rebuild_usage_statistics(app)
+                elif choice == '21':
+                    user_id = int(input("Enter user ID the token acts as: "))
+                    name = input("Enter device name: ")
+                    utils.add_api_token(user_id, name)
                 else:
                     print("Invalid choice. Please try again.")
-    except KeyboardInterrupt:
-        utils.shutdown_server()
+    except (KeyboardInterrupt, EOFError):
+        pass
+
+def run_server_with_console(app, options):
+    server = create_server(app, **options)
+    # Bind before the menu appears so a port clash is reported straight away
+    server.prepare()
+    server_thread = threading.Thread(target=server.serve, name='web-server', daemon=True)
+    server_thread.start()
+    try:
+        run_console(app)
+    finally:
+        server.stop()
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='app', description='ToolTracker server and management console.')
+    commands = parser.add_subparsers(dest='command')
+    serve_parser = commands.add_parser('serve', help='run the web server')
+    serve_parser.add_argument('--host', help='address to listen on (default SERVER_HOST)')
+    serve_parser.add_argument('--port', type=int, help='port to listen on (default SERVER_PORT)')
+    serve_parser.add_argument('--threads', type=int, help='worker threads (default SERVER_THREADS)')
+    serve_parser.add_argument('--timeout', type=int, help='seconds a request or idle connection may take')
+    serve_parser.add_argument('--keep-alive', type=int, dest='keep_alive_connections',
+                              help='idle keep-alive connections to hold open, 0 to disable')
+    serve_parser.add_argument('--console', action='store_true', help='also run the management console')
+    commands.add_parser('console', help='run the management console without a web server')
+    reconcile_parser = commands.add_parser('reconcile', help='repair tools whose availability disagrees with the open loans')
+    reconcile_parser.add_argument('--dry-run', action='store_true', help='only report the tools that are out of step')
+    return parser.parse_args()
 
 if __name__ == '__main__':
+    # Needed for the QR decoding process pool inside the PyInstaller build
+    multiprocessing.freeze_support()
+    args = parse_args()
     app = create_app()
-    get_self_ip()
-    print("   ")
-    def run_web_server():
-        log = logging.getLogger('werkzeug')
-        log.setLevel(logging.ERROR)
 
-        try:
-            context = (os.path.join(app.config['CERTS_PATH'], 'certificate.pem'),
-                       os.path.join(app.config['CERTS_PATH'], 'key.pem'))
-            app.run(debug=True, ssl_context=context, host='0.0.0.0', port=5000, use_reloader=False)
-        except RuntimeError as e:
-            if 'SSL is unavailable' in str(e):
-                print("   ")
+    try:
+        if args.command == 'console':
+            run_console(app)
+        elif args.command == 'reconcile':
+            with app.app_context():
+                utils.reconcile_tool_availability(dry_run=args.dry_run)
+        else:
+            start_background_task('self-ip', get_self_ip)
+            options = {key: getattr(args, key, None)
+                       for key in ('host', 'port', 'threads', 'timeout', 'keep_alive_connections')}
+            # Double-clicking the packaged exe passes no arguments: server and console together, as before
+            if args.command is None or args.console:
+                run_server_with_console(app, options)
             else:
-                raise
-
-    web_thread = threading.Thread(target=run_web_server)
-    web_thread.start()
-    time.sleep(1)
-    run_console(app)
\ No newline at end of file
+                serve(app, **options)
+    finally:
+        # Queued QR and import work is dropped rather than finished on the way out
+        shutdown_process_pools()
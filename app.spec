@@ -6,10 +6,12 @@ a = Analysis(
     binaries=[],
     datas=[
         ('templates', 'templates'),  # Ensure you have your templates directory added
+        ('static', 'static'),  # app.css and app.js, served with fingerprinted URLs
+        ('migrations', 'migrations'),  # Alembic env.py and version scripts, run on startup
         ('C:\\Users\\Jirka\\anaconda3\\envs\\tooltracker\\Lib\\site-packages\\pyzbar\\libiconv.dll', '.'),  # Corrected line
         ('C:\\Users\\Jirka\\anaconda3\\envs\\tooltracker\\Lib\\site-packages\\pyzbar\\libzbar-64.dll', '.'),  # Add the path to your libzbar-64.dll file
     ],
-    hiddenimports=['pysqlite2', 'MySQLdb', 'psycopg2'],
+    hiddenimports=['pysqlite2', 'MySQLdb', 'psycopg2', 'alembic.context', 'alembic.op'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
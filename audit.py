@@ -0,0 +1,131 @@
+import atexit
+import datetime
+import logging
+import queue
+import threading
+import time
+from sqlalchemy import insert
+from models import db, ToolLog
+from log_stream import notify_new_logs
+
+logger = logging.getLogger('tooltracker.audit')
+
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = 0.2
+
+
+def build_log_values(event_type, user, tool, duration=None, now=None):
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    formatted_timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
+
+    log_message = f"{formatted_timestamp} - {event_type}: User {user.username} ({user.id}) - Tool {tool.name} ({tool.id})"
+    if duration:
+        log_message += f" - Duration: {duration}"
+    logger.info(log_message)
+
+    return dict(
+        tool_name=tool.name,
+        username=user.username,
+        action=event_type,
+        details=f"Time Lended: {duration}" if duration else None,
+        timestamp=now
+    )
+
+
+def write_logs(entries):
+    db.session.execute(insert(ToolLog), entries)
+    db.session.commit()
+    notify_new_logs()
+
+
+class AuditWriter(threading.Thread):
+    def __init__(self, app, queue_size=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE, interval=AUDIT_FLUSH_INTERVAL):
+        super().__init__(name='audit-writer', daemon=True)
+        self.app = app
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.interval = interval
+
+    def submit(self, entries):
+        # A full queue blocks the caller: slower requests beat lost audit rows
+        self.queue.put(list(entries))
+
+    def collect(self):
+        batch, taken, deadline = [], 0, None
+        while len(batch) < self.batch_size:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                entries = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            taken += 1
+            if entries is None:
+                return batch, taken, True
+            batch.extend(entries)
+            if deadline is None:
+                # Whatever arrives within the interval after the first entry shares one commit
+                deadline = time.monotonic() + self.interval
+        return batch, taken, False
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch, taken, stopping = self.collect()
+            if batch:
+                self.write(batch)
+            for _ in range(taken):
+                self.queue.task_done()
+
+    def write(self, batch):
+        with self.app.app_context():
+            try:
+                write_logs(batch)
+            except Exception:
+                db.session.rollback()
+                logger.exception("Could not write %d audit log entries", len(batch))
+            finally:
+                db.session.remove()
+
+    def flush(self):
+        self.queue.join()
+
+    def stop(self):
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+
+
+_writer = None
+
+
+def start_audit_writer(app):
+    global _writer
+    if app.config.get('AUDIT_LOG_SYNC'):
+        return None
+    _writer = AuditWriter(app,
+                          queue_size=app.config.get('AUDIT_QUEUE_SIZE', AUDIT_QUEUE_SIZE),
+                          batch_size=app.config.get('AUDIT_BATCH_SIZE', AUDIT_BATCH_SIZE),
+                          interval=app.config.get('AUDIT_FLUSH_INTERVAL', AUDIT_FLUSH_INTERVAL))
+    _writer.start()
+    app.extensions['audit_writer'] = _writer
+    # Daemon threads are still alive when atexit runs, so pending rows get written on the way out
+    atexit.register(_writer.stop)
+    return _writer
+
+
+def record_events(entries):
+    if not entries:
+        return
+    if _writer is not None and _writer.is_alive():
+        _writer.submit(entries)
+    else:
+        # Synchronous mode (AUDIT_LOG_SYNC, tests and one-off scripts): written before returning
+        write_logs(entries)
+
+
+def flush_audit_log():
+    if _writer is not None and _writer.is_alive():
+        _writer.flush()
@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import namedtuple
+from flask import g, has_request_context, session
+from models import db, User
+
+ROLE_CACHE_TTL = 60
+
+# Plain snapshot rather than a User instance, so it can outlive the session that loaded it
+CurrentUser = namedtuple('CurrentUser', ['id', 'username', 'is_admin'])
+
+
+class RoleCache:
+    def __init__(self, ttl=ROLE_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        user = db.session.get(User, user_id)
+        # Unknown ids are cached too, a deleted account should not cost a query per request
+        snapshot = CurrentUser(user.id, user.username, bool(user.is_admin)) if user else None
+        with self.lock:
+            self.entries[user_id] = (now + self.ttl, snapshot)
+        return snapshot
+
+    def invalidate(self, user_id=None):
+        with self.lock:
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
+
+
+role_cache = RoleCache()
+
+
+def invalidate_user_roles(user_id=None):
+    role_cache.invalidate(user_id)
+
+
+def get_current_user():
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = role_cache.get(user_id) if user_id is not None else None
+    return g.current_user
+
+
+def get_user_role(user_id):
+    if user_id is None:
+        return None
+    if has_request_context() and user_id == session.get('user_id'):
+        return get_current_user()
+    return role_cache.get(user_id)
+
+
+def is_admin(user_id):
+    user = get_user_role(user_id)
+    return user.is_admin if user else False
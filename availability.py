@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import select, update
+from models import db, Tool, User, Transaction
+
+AVAILABILITY_TTL = 30
+
+OpenLoan = namedtuple('OpenLoan', ['transaction_id', 'tool_id', 'tool_name', 'location',
+                                   'user_id', 'username', 'borrow_date'])
+
+
+def load_open_loans():
+    rows = db.session.query(Transaction.id, Tool.id, Tool.name, Tool.location,
+                            User.id, User.username, Transaction.borrow_date) \
+        .join(Tool, Transaction.tool_id == Tool.id) \
+        .join(User, Transaction.user_id == User.id) \
+        .filter(Transaction.return_date.is_(None)) \
+        .order_by(Transaction.borrow_date, Transaction.id) \
+        .all()
+    return tuple(OpenLoan(*row) for row in rows)
+
+
+class AvailabilitySnapshot:
+    def __init__(self, ttl=AVAILABILITY_TTL):
+        # Lend and return invalidate it; the TTL only bounds writes made outside this process
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.loans = None
+        self.expires = 0
+        self.generation = 0
+
+    def get(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.loans is not None and self.expires > now:
+                return self.loans
+            generation = self.generation
+
+        loans = load_open_loans()
+        with self.lock:
+            # Invalidated while loading: these rows may predate the change, so do not keep them
+            if generation == self.generation:
+                self.loans = loans
+                self.expires = now + self.ttl
+        return loans
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.loans = None
+
+
+availability = AvailabilitySnapshot()
+
+
+def get_open_loans():
+    return availability.get()
+
+
+def invalidate_availability():
+    availability.invalidate()
+
+
+def rented_by_subquery():
+    return select(User.username) \
+        .join(Transaction, Transaction.user_id == User.id) \
+        .where(Transaction.tool_id == Tool.id, Transaction.return_date.is_(None)) \
+        .scalar_subquery()
+
+
+def reconcile_availability(dry_run=False):
+    rented_by = rented_by_subquery()
+    drifted = db.session.query(Tool.id, Tool.name, Tool.rented_by, rented_by.label('expected')) \
+        .filter(Tool.rented_by.isnot(rented_by)) \
+        .order_by(Tool.id) \
+        .all()
+    if drifted and not dry_run:
+        db.session.execute(update(Tool).where(Tool.id.in_([tool.id for tool in drifted])).values(rented_by=rented_by),
+                           execution_options={'synchronize_session': False})
+        db.session.commit()
+        db.session.expire_all()
+    invalidate_availability()
+    return [{'id': tool.id, 'name': tool.name, 'rented_by': tool.rented_by, 'expected': tool.expected}
+            for tool in drifted]
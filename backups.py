@@ -0,0 +1,258 @@
+import datetime
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import nullcontext
+from flask import has_app_context
+from api_tokens import token_cache
+from audit import flush_audit_log
+from auth import invalidate_user_roles
+from availability import invalidate_availability
+from page_cache import bump_data_version
+from models import db
+from schema import upgrade_database
+
+BACKUP_PREFIX = 'database_backup_'
+BACKUP_EXTENSIONS = ('.db', '.db.gz')
+CHECKSUM_EXTENSION = '.sha256'
+REQUIRED_TABLES = {'tool', 'user', 'transaction', 'tool_log'}
+# Seconds a restore waits for a write that is in progress on the live database
+RESTORE_LOCK_TIMEOUT = 30
+
+
+def get_database_path(app):
+    return app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
+
+
+def get_backups_path(app):
+    backups_path = app.config['BACKUPS_PATH']
+    os.makedirs(backups_path, exist_ok=True)
+    return backups_path
+
+
+def file_checksum(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    digest = hashlib.sha256()
+    with opener(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_checksum(backup_path):
+    try:
+        with open(backup_path + CHECKSUM_EXTENSION) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def copy_database(source_path, target_path, pages=256, sleep=0.005, timeout=5.0):
+    # Copies `pages` pages per step and releases the read lock in between,
+    # so lend/return writes keep going while a large backup runs
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path, timeout=timeout)
+    try:
+        with target:
+            source.backup(target, pages=pages, sleep=sleep)
+    finally:
+        target.close()
+        source.close()
+
+
+def list_backups(app):
+    backups_path = get_backups_path(app)
+    backups = []
+    for name in os.listdir(backups_path):
+        if not name.startswith(BACKUP_PREFIX) or not name.endswith(BACKUP_EXTENSIONS):
+            continue
+        path = os.path.join(backups_path, name)
+        stat = os.stat(path)
+        backups.append({
+            'name': name,
+            'path': path,
+            'size': stat.st_size,
+            'created': datetime.datetime.fromtimestamp(stat.st_mtime),
+            'compressed': name.endswith('.gz'),
+        })
+    # Names embed the timestamp, so sorting by name is chronological
+    return sorted(backups, key=lambda backup: backup['name'], reverse=True)
+
+
+def create_backup(app, compress=None):
+    if compress is None:
+        compress = app.config.get('BACKUP_COMPRESS', True)
+    backups_path = get_backups_path(app)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+    backup_path = os.path.join(backups_path, f'{BACKUP_PREFIX}{timestamp}.db')
+    partial_path = backup_path + '.partial'
+
+    copy_database(get_database_path(app), partial_path, pages=app.config.get('BACKUP_PAGES_PER_STEP', 256))
+    checksum = file_checksum(partial_path)
+
+    # Incremental: if nothing changed since the newest snapshot, keep that one instead of a duplicate
+    backups = list_backups(app)
+    if backups and read_checksum(backups[0]['path']) == checksum:
+        os.remove(partial_path)
+        print(f"Database unchanged since {backups[0]['name']}, no new backup needed.")
+        return backups[0]['path']
+
+    if compress:
+        backup_path += '.gz'
+        with open(partial_path, 'rb') as source, gzip.open(backup_path + '.partial', 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        os.remove(partial_path)
+        partial_path = backup_path + '.partial'
+
+    with open(backup_path + CHECKSUM_EXTENSION, 'w') as f:
+        f.write(checksum)
+    os.replace(partial_path, backup_path)
+    print(f"Backup created at {backup_path}")
+
+    prune_backups(app)
+    return backup_path
+
+
+def remove_backup(backup_path):
+    os.remove(backup_path)
+    if os.path.exists(backup_path + CHECKSUM_EXTENSION):
+        os.remove(backup_path + CHECKSUM_EXTENSION)
+
+
+def prune_backups(app):
+    keep_count = app.config.get('BACKUP_RETENTION_COUNT')
+    keep_days = app.config.get('BACKUP_RETENTION_DAYS')
+    backups = list_backups(app)
+    removed = []
+
+    for index, backup in enumerate(backups):
+        # Never delete the newest snapshot, whatever the policy says
+        if index == 0:
+            continue
+        too_many = keep_count is not None and index >= keep_count
+        too_old = keep_days is not None and backup['created'] < datetime.datetime.now() - datetime.timedelta(days=keep_days)
+        if too_many or too_old:
+            remove_backup(backup['path'])
+            removed.append(backup['name'])
+
+    if removed:
+        print(f"Removed {len(removed)} old backup(s).")
+    return removed
+
+
+def find_backup(app, name=None, restore_point=None):
+    backups = list_backups(app)
+    if name:
+        # Only names we listed ourselves, never a path from the form
+        matches = [backup for backup in backups if backup['name'] == name]
+        if not matches:
+            raise ValueError(f"Backup {name} not found.")
+        return matches[0]['path']
+    if restore_point:
+        matches = [backup for backup in backups if backup['created'] <= restore_point]
+        if not matches:
+            raise ValueError(f"No backup exists from before {restore_point:%Y-%m-%d %H:%M}.")
+        return matches[0]['path']
+    if not backups:
+        raise ValueError("No backup files found.")
+    return backups[0]['path']
+
+
+def decompress_to(source_path, target_path):
+    digest = hashlib.sha256()
+    with gzip.open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(chunk)
+            target.write(chunk)
+    return digest.hexdigest()
+
+
+def validate_snapshot(path):
+    try:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            result = conn.execute('PRAGMA quick_check').fetchone()[0]
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Not a valid database snapshot: {e}") from e
+    if result != 'ok':
+        raise ValueError(f"Snapshot failed integrity check: {result}")
+    missing = REQUIRED_TABLES - tables
+    if missing:
+        raise ValueError(f"Snapshot is missing tables: {', '.join(sorted(missing))}")
+
+
+def restore_backup(app, backup_path, safety_backup=True):
+    database_path = get_database_path(app)
+    restore_path = database_path + '.restore'
+    expected = read_checksum(backup_path)
+
+    try:
+        # Staged and checked in full before anything touches the live file
+        if backup_path.endswith('.gz'):
+            checksum = decompress_to(backup_path, restore_path)
+        else:
+            checksum = file_checksum(backup_path) if expected else None
+            if os.path.exists(restore_path):
+                os.remove(restore_path)
+            copy_database(backup_path, restore_path, pages=-1)
+        if expected and checksum != expected:
+            raise ValueError(f"Checksum mismatch for {os.path.basename(backup_path)}, the file is corrupt.")
+        validate_snapshot(restore_path)
+
+        # Queued audit rows belong to the database being replaced; write them before the safety copy
+        flush_audit_log()
+        if safety_backup:
+            create_backup(app)
+
+        # Copied page by page into the live file rather than renamed over it: connections other threads
+        # hold stay valid, and SQLite's own locking makes them wait for the copy or see all of it
+        copy_database(restore_path, database_path, pages=-1, timeout=RESTORE_LOCK_TIMEOUT)
+        with nullcontext() if has_app_context() else app.app_context():
+            db.session.remove()
+            # Accounts, roles, API tokens and loans in the snapshot may differ from the ones cached
+            invalidate_user_roles()
+            token_cache.clear()
+            invalidate_availability()
+            bump_data_version()
+    finally:
+        for path in (restore_path, restore_path + '-wal', restore_path + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Older snapshots may predate the current schema
+    upgrade_database(app)
+    print(f"Database restored from {backup_path}")
+
+
+class BackupScheduler(threading.Thread):
+    def __init__(self, app, interval_hours):
+        super().__init__(name='backup-scheduler', daemon=True)
+        self.app = app
+        self.interval = interval_hours * 3600
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                create_backup(self.app)
+            except (sqlite3.Error, OSError) as e:
+                print(f"Scheduled backup failed: {e}")
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_backup_scheduler(app):
+    interval_hours = app.config.get('BACKUP_INTERVAL_HOURS')
+    if not interval_hours:
+        return None
+    scheduler = BackupScheduler(app, interval_hours)
+    scheduler.start()
+    app.extensions['backup_scheduler'] = scheduler
+    return scheduler
@@ -0,0 +1,214 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SIZES = {
+    'small': {'users': 50, 'tools': 2000, 'transactions': 20000, 'logs': 100000},
+    'medium': {'users': 500, 'tools': 20000, 'transactions': 200000, 'logs': 1000000},
+    'large': {'users': 2000, 'tools': 100000, 'transactions': 1000000, 'logs': 5000000},
+}
+PASSWORD = 'bench'
+BATCH_SIZE = 50000
+TOOL_NAMES = ('Hammer', 'Screwdriver', 'Wrench', 'Pliers', 'Drill', 'Saw', 'Tape Measure', 'Level',
+              'Chisel', 'Clamp', 'Sander', 'Multimeter', 'Soldering Iron', 'Ladder', 'Torch')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def database_path(data_dir):
+    # create_app keeps everything under %LOCALAPPDATA%\ToolTracker
+    return os.path.join(data_dir, 'ToolTracker', 'database', 'app.db')
+
+
+def create_bench_app(data_dir):
+    from startup import prepare_data_dir
+    from static_assets import VENDOR_ASSETS
+    if not os.path.exists(os.path.join(data_dir, 'ToolTracker', 'certs', 'key.pem')):
+        prepare_data_dir(data_dir)
+    # Placeholders, so starting the app does not go off downloading page assets
+    assets_path = os.path.join(data_dir, 'ToolTracker', 'static')
+    for name in VENDOR_ASSETS:
+        path = os.path.join(assets_path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(path):
+            open(path, 'w').close()
+    os.environ['LOCALAPPDATA'] = data_dir
+    # Audit lines on the console would be measured along with the requests
+    os.environ.setdefault('TOOLTRACKER_LOG_LEVEL', 'WARNING')
+    from config import create_app
+    return create_app()
+
+
+def timestamp(value):
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def insert_rows(connection, statement, rows):
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            connection.executemany(statement, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        connection.executemany(statement, batch)
+        count += len(batch)
+    return count
+
+
+def spread(rng, count, start, end):
+    # Ascending times, so ids and timestamps grow together as they do in real use
+    step = (end - start).total_seconds() / max(count, 1)
+    for index in range(count):
+        yield start + datetime.timedelta(seconds=index * step + rng.random() * step)
+
+
+def user_rows(count, password_hash):
+    # user000001 is the admin the benchmark logs in with for the admin pages
+    for user_id in range(1, count + 1):
+        yield user_id, f'user{user_id:06d}', password_hash, user_id == 1
+
+
+def tool_rows(count):
+    for tool_id in range(1, count + 1):
+        yield (tool_id, f'{TOOL_NAMES[tool_id % len(TOOL_NAMES)]} {tool_id}', f'Shelf {tool_id % 400 + 1}',
+               f'bench{tool_id:010d}')
+
+
+def transaction_rows(rng, count, users, tools, open_tools, start, now):
+    returned = count - len(open_tools)
+    for borrow_date in spread(rng, returned, start, now - datetime.timedelta(days=1)):
+        seconds = min(int(rng.expovariate(1 / (2 * 86400))) + 60, int((now - borrow_date).total_seconds()))
+        return_date = borrow_date + datetime.timedelta(seconds=seconds)
+        yield (rng.randint(1, users), rng.randint(1, tools), timestamp(borrow_date), timestamp(return_date), seconds)
+    # The newest loans are the ones still out; one per tool, as the open-loan index demands
+    recent = spread(rng, len(open_tools), now - datetime.timedelta(days=30), now)
+    for tool_id, borrow_date in zip(open_tools, recent):
+        yield rng.randint(1, users), tool_id, timestamp(borrow_date), None, None
+
+
+def log_rows(rng, count, users, tools, start, now):
+    for logged_at in spread(rng, count, start, now):
+        user_id = rng.randint(1, users)
+        tool_id = rng.randint(1, tools)
+        action = 'LEND' if rng.random() < 0.5 else 'RETURN'
+        details = f'Borrowed for {rng.randint(1, 72)} hours' if action == 'RETURN' else None
+        yield (f'{TOOL_NAMES[tool_id % len(TOOL_NAMES)]} {tool_id}', f'user{user_id:06d}', action,
+               timestamp(logged_at), details)
+
+
+def seed_database(app, users, tools, transactions, logs, open_fraction=0.1, days=365, seed=1):
+    from werkzeug.security import generate_password_hash
+    from analytics import rebuild_usage_rollups
+    from models import db
+
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    start = now - datetime.timedelta(days=days)
+    open_tools = sorted(rng.sample(range(1, tools + 1), min(int(tools * open_fraction), transactions)))
+    path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
+    timings = {}
+
+    with app.app_context():
+        db.engine.dispose()
+    connection = sqlite3.connect(path)
+    try:
+        # Nothing here is worth an fsync: a crash just means seeding again
+        connection.execute('PRAGMA synchronous=OFF')
+        for table, statement, rows in (
+            ('users', 'INSERT INTO "user" (id, username, password_hash, is_admin) VALUES (?, ?, ?, ?)',
+             user_rows(users, generate_password_hash(PASSWORD))),
+            ('tools', 'INSERT INTO tool (id, name, location, qr_token) VALUES (?, ?, ?, ?)', tool_rows(tools)),
+            ('transactions', 'INSERT INTO "transaction" (user_id, tool_id, borrow_date, return_date, duration_seconds) '
+                             'VALUES (?, ?, ?, ?, ?)',
+             transaction_rows(rng, transactions, users, tools, open_tools, start, now)),
+            ('logs', 'INSERT INTO tool_log (tool_name, username, action, timestamp, details) VALUES (?, ?, ?, ?, ?)',
+             log_rows(rng, logs, users, tools, start, now)),
+        ):
+            started = time.perf_counter()
+            with connection:
+                insert_rows(connection, statement, rows)
+            timings[table] = round(time.perf_counter() - started, 2)
+        started = time.perf_counter()
+        connection.execute('ANALYZE')
+        timings['analyze'] = round(time.perf_counter() - started, 2)
+    finally:
+        connection.close()
+
+    started = time.perf_counter()
+    with app.app_context():
+        rebuild_usage_rollups(app)
+    timings['rollups'] = round(time.perf_counter() - started, 2)
+    return {
+        'users': users,
+        'tools': tools,
+        'transactions': transactions,
+        'open_loans': len(open_tools),
+        'logs': logs,
+        'seed': seed,
+        'seconds': timings,
+    }
+
+
+def is_seeded(app):
+    from models import db, Tool
+    with app.app_context():
+        return db.session.query(Tool.id).first() is not None
+
+
+def add_size_arguments(parser):
+    parser.add_argument('--size', choices=SIZES, default='small', help='preset dataset size (default small)')
+    for name in ('users', 'tools', 'transactions', 'logs'):
+        parser.add_argument(f'--{name}', type=int, help=f'override the number of {name} in the preset')
+    parser.add_argument('--open-fraction', type=float, default=0.1, help='share of tools lent out (default 0.1)')
+    parser.add_argument('--days', type=int, default=365, help='days of history to spread the rows over')
+    parser.add_argument('--seed', type=int, default=1, help='random seed; the same seed gives the same data')
+
+
+def dataset_options(args):
+    options = dict(SIZES[args.size])
+    for name in options:
+        if getattr(args, name) is not None:
+            options[name] = getattr(args, name)
+    if options['users'] < 1 or options['tools'] < 1:
+        raise ValueError('At least one user and one tool are needed.')
+    return dict(options, open_fraction=args.open_fraction, days=args.days, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill a fresh ToolTracker data folder with synthetic data.')
+    parser.add_argument('data_dir', help='folder used as LOCALAPPDATA; the database goes under ToolTracker/')
+    add_size_arguments(parser)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    try:
+        options = dataset_options(args)
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(args.data_dir, exist_ok=True)
+    app = create_bench_app(os.path.abspath(args.data_dir))
+    if is_seeded(app):
+        parser.error(f'{database_path(args.data_dir)} already has data')
+    result = seed_database(app, **options)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"Seeded {result['users']} users, {result['tools']} tools, {result['transactions']} transactions "
+          f"({result['open_loans']} open) and {result['logs']} log rows.")
+    print(', '.join(f'{step} {seconds} s' for step, seconds in result['seconds'].items()))
+    print(f"Every user's password is '{PASSWORD}'; user000001 is an admin.")
+
+
+if __name__ == '__main__':
+    main()
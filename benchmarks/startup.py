@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+URL = 'https://127.0.0.1:5000/login'
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def prepare_data_dir(base_dir):
+    # create_app keeps everything under %LOCALAPPDATA%\ToolTracker
+    app_dir = os.path.join(base_dir, 'ToolTracker')
+    certs_path = os.path.join(app_dir, 'certs')
+    os.makedirs(certs_path, exist_ok=True)
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=localhost',
+                    '-days', '1', '-keyout', os.path.join(certs_path, 'key.pem'),
+                    '-out', os.path.join(certs_path, 'certificate.pem')],
+                   check=True, capture_output=True)
+    # Pretend the bundled OpenSSL is already there so no run starts a download
+    openssl_bin = os.path.join(app_dir, 'openssl', 'openssl', 'openssl-3', 'x64', 'bin')
+    os.makedirs(openssl_bin, exist_ok=True)
+    open(os.path.join(openssl_bin, 'openssl.exe'), 'w').close()
+
+
+def port_in_use(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        return s.connect_ex(('127.0.0.1', port)) == 0
+
+
+def wait_for_first_request(process, timeout):
+    context = ssl._create_unverified_context()
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app exited with code {process.returncode} before serving a request")
+        try:
+            with urllib.request.urlopen(URL, context=context, timeout=1) as response:
+                response.read()
+                return
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.01)
+    raise RuntimeError(f"no response from {URL} within {timeout}s")
+
+
+def measure_start(command, data_dir, timeout):
+    env = dict(os.environ, LOCALAPPDATA=data_dir)
+    start = time.perf_counter()
+    # stdin stays an open pipe so the console menu just waits instead of reading EOF
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdin=subprocess.PIPE,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_first_request(process, timeout)
+        return time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait()
+
+
+def profile_imports(python, module, top):
+    result = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append({'module': name, 'depth': len(indent) // 2,
+                            'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000})
+    total = sum(entry['self_ms'] for entry in modules)
+    modules.sort(key=lambda entry: entry['cumulative_ms'], reverse=True)
+    return {'module': module, 'total_ms': round(total, 1), 'slowest': modules[:top]}
+
+
+def summarize(samples):
+    return {
+        'runs': len(samples),
+        'min_ms': round(min(samples) * 1000, 1),
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'max_ms': round(max(samples) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure ToolTracker cold start to the first served request.')
+    parser.add_argument('--runs', type=int, default=5, help='restarts measured against the same data folder')
+    parser.add_argument('--executable', help='packaged build to start instead of "python app.py"')
+    parser.add_argument('--python', default=sys.executable)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--imports', type=int, default=15, metavar='N',
+                        help='show the N slowest imports of the app modules (0 to skip)')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    if port_in_use(5000):
+        parser.error('port 5000 is already in use, stop the running server first')
+
+    command = [args.executable] if args.executable else [args.python, 'app.py']
+    data_dir = tempfile.mkdtemp(prefix='tooltracker-bench-')
+    try:
+        prepare_data_dir(data_dir)
+        # The first start also creates the database and runs every migration
+        first_run = measure_start(command, data_dir, args.timeout)
+        restarts = [measure_start(command, data_dir, args.timeout) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    results = {
+        'command': command,
+        'first_run_ms': round(first_run * 1000, 1),
+        'restart': summarize(restarts),
+    }
+    if args.imports and not args.executable:
+        results['imports'] = profile_imports(args.python, 'config', args.imports)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"First start (new database): {results['first_run_ms']} ms")
+    restart = results['restart']
+    print(f"Restart to first request over {restart['runs']} run(s): "
+          f"min {restart['min_ms']} ms, median {restart['median_ms']} ms, max {restart['max_ms']} ms")
+    if 'imports' in results:
+        print(f"\nImporting {results['imports']['module']}: {results['imports']['total_ms']} ms in total")
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for entry in results['imports']['slowest']:
+            print(f"{entry['cumulative_ms']:>14.1f} {entry['self_ms']:>9.1f}  {'  ' * entry['depth']}{entry['module']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,505 @@
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from seed import (PASSWORD, ROOT, TOOL_NAMES, add_size_arguments, create_bench_app, database_path,
+                  dataset_options, is_seeded, seed_database)
+from startup import port_in_use
+
+DEFAULT_MIX = 'lend=30,return=30,inventory=25,logs=15'
+PERCENTILES = (50, 90, 95, 99)
+RESULTS_PATH = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ACTIONS:
+            raise ValueError(f"Unknown action '{name}', choose from {', '.join(ACTIONS)}")
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"Invalid weight for {name}: {weight}")
+        if weight > 0:
+            mix.append((name, weight))
+    if not mix:
+        raise ValueError('The mix is empty.')
+    return mix
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, body=None, headers=None):
+        response = self.client.open(path, method=method, data=form, json=body, headers=headers)
+        response.get_data()
+        return response.status_code, response.headers.get('ETag')
+
+
+class HttpSession:
+    # One kept-alive connection per worker, the way a browser tab talks to the server
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.context = ssl._create_unverified_context()
+        self.connection = None
+        self.cookie = None
+
+    def connect(self):
+        self.connection = http.client.HTTPSConnection(self.host, self.port, context=self.context, timeout=60)
+
+    def request(self, method, path, form=None, body=None, headers=None):
+        headers = dict(headers or {})
+        data = None
+        if form is not None:
+            data = urllib.parse.urlencode(form, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connect()
+            try:
+                self.connection.request(method, path, body=data, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed an idle keep-alive connection; reconnect once
+                self.connection.close()
+                self.connection = None
+                if attempt == 2:
+                    raise
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+            self.connection = None
+        return response.status, response.getheader('ETag')
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+class QueryCounter:
+    # The test client runs each request on the calling thread, so a thread-local count is per request
+    def __init__(self):
+        self.local = threading.local()
+
+    def install(self, app):
+        from sqlalchemy import event
+        from models import db
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def count(self, *args):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    def read(self):
+        return getattr(self.local, 'count', 0)
+
+
+def lend(worker):
+    if not worker.free:
+        return ret(worker)
+    tool_id = worker.free.pop(worker.rng.randrange(len(worker.free)))
+    worker.lent.append(tool_id)
+    return 'lend', 'POST', '/lend', {'tool_ids': [tool_id]}, None
+
+
+def ret(worker):
+    if not worker.lent:
+        return lend(worker)
+    tool_id = worker.lent.pop(worker.rng.randrange(len(worker.lent)))
+    worker.free.append(tool_id)
+    return 'return', 'POST', '/return', {'tool_ids': [tool_id]}, None
+
+
+def api_lend(worker):
+    if not worker.free:
+        return api_return(worker)
+    tool_id = worker.free.pop(worker.rng.randrange(len(worker.free)))
+    worker.lent.append(tool_id)
+    return 'api_lend', 'POST', '/api/v1/checkout', None, {'tool_id': tool_id}
+
+
+def api_return(worker):
+    if not worker.lent:
+        return api_lend(worker)
+    tool_id = worker.lent.pop(worker.rng.randrange(len(worker.lent)))
+    worker.free.append(tool_id)
+    return 'api_return', 'POST', '/api/v1/checkin', None, {'tool_id': tool_id}
+
+
+def inventory(worker):
+    return 'inventory', 'GET', '/inventory', None, None
+
+
+def search(worker):
+    query = urllib.parse.urlencode({'q': worker.rng.choice(TOOL_NAMES), 'availability': 'available'})
+    return 'search', 'GET', f'/api/tools/search?{query}', None, None
+
+
+def tool(worker):
+    return 'tool', 'GET', f'/api/v1/tools/{worker.rng.randint(1, worker.tool_count)}', None, None
+
+
+def logs(worker):
+    return 'logs', 'GET', '/logs', None, None
+
+
+def index(worker):
+    return 'index', 'GET', '/', None, None
+
+
+ACTIONS = {
+    'lend': lend,
+    'return': ret,
+    'api_lend': api_lend,
+    'api_return': api_return,
+    'inventory': inventory,
+    'search': search,
+    'tool': tool,
+    'logs': logs,
+    'index': index,
+}
+
+
+class Worker(threading.Thread):
+    def __init__(self, index, session, username, free, tool_count, mix, seed, requests, warmup,
+                 barrier, counter=None, revalidate=False):
+        super().__init__(name=f'bench-worker-{index}', daemon=True)
+        self.session = session
+        self.username = username
+        self.free = free
+        self.lent = []
+        self.tool_count = tool_count
+        self.actions = [ACTIONS[name] for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.rng = random.Random(seed * 1000 + index)
+        self.requests = requests
+        self.warmup = warmup
+        self.barrier = barrier
+        self.counter = counter
+        self.revalidate = revalidate
+        self.etags = {}
+        self.samples = []
+        self.error = None
+
+    def send(self, route, method, path, form, body):
+        headers = {}
+        if self.revalidate and method == 'GET' and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        if self.counter is not None:
+            self.counter.reset()
+        started = time.perf_counter()
+        status, etag = self.session.request(method, path, form=form, body=body, headers=headers)
+        elapsed = time.perf_counter() - started
+        if etag and method == 'GET':
+            self.etags[path] = etag
+        queries = self.counter.read() if self.counter is not None else None
+        return route, elapsed, status, queries
+
+    def next_request(self):
+        return self.rng.choices(self.actions, self.weights)[0](self)
+
+    def run(self):
+        try:
+            status, _ = self.session.request('POST', '/login', form={'username': self.username, 'password': PASSWORD})
+            if status not in (200, 302):
+                raise RuntimeError(f'login as {self.username} failed with {status}')
+            for _ in range(self.warmup):
+                self.send(*self.next_request())
+        except Exception as e:
+            self.error = e
+            self.barrier.abort()
+            return
+        try:
+            self.barrier.wait()
+            for _ in range(self.requests):
+                self.samples.append(self.send(*self.next_request()))
+        except Exception as e:
+            self.error = e
+
+
+def free_tools(path):
+    connection = sqlite3.connect(path)
+    try:
+        return [row[0] for row in connection.execute('SELECT id FROM tool WHERE rented_by IS NULL ORDER BY id')]
+    finally:
+        connection.close()
+
+
+def dataset_counts(path):
+    connection = sqlite3.connect(path)
+    try:
+        counts = {}
+        for name, table in (('users', '"user"'), ('tools', 'tool'), ('transactions', '"transaction"'),
+                            ('logs', 'tool_log')):
+            counts[name] = connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        counts['open_loans'] = connection.execute(
+            'SELECT COUNT(*) FROM "transaction" WHERE return_date IS NULL').fetchone()[0]
+        return counts
+    finally:
+        connection.close()
+
+
+def run_workers(make_session, path, workers, requests, warmup, mix, seed, counter=None, revalidate=False):
+    tools = free_tools(path)
+    random.Random(seed).shuffle(tools)
+    tool_count = dataset_counts(path)['tools']
+    per_worker = [requests // workers + (1 if index < requests % workers else 0) for index in range(workers)]
+    barrier = threading.Barrier(workers + 1)
+    # Every worker lends from its own share of the free tools, so no lend fails on another worker's loan
+    threads = [Worker(index, make_session(), f'user{index + 1:06d}', tools[index::workers], tool_count, mix,
+                      seed, per_worker[index], warmup, barrier, counter, revalidate)
+               for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    for thread in threads:
+        if hasattr(thread.session, 'close'):
+            thread.session.close()
+        if thread.error is not None:
+            raise RuntimeError(f'{thread.name} failed: {thread.error}')
+    return [sample for thread in threads for sample in thread.samples], wall
+
+
+def percentile(values, p):
+    # Linear interpolation between the closest ranks; values must be sorted
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(samples, wall):
+    latencies = sorted(elapsed * 1000 for _, elapsed, _, _ in samples)
+    queries = [count for _, _, _, count in samples if count is not None]
+    summary = {
+        'requests': len(samples),
+        'errors': sum(status >= 400 for _, _, status, _ in samples),
+        'not_modified': sum(status == 304 for _, _, status, _ in samples),
+        'throughput_rps': round(len(samples) / wall, 1) if wall else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 2),
+            **{f'p{p}': round(percentile(latencies, p), 2) for p in PERCENTILES},
+            'max': round(latencies[-1], 2),
+        },
+        'queries': None,
+    }
+    if queries:
+        summary['queries'] = {'mean': round(sum(queries) / len(queries), 2), 'max': max(queries),
+                              'total': sum(queries)}
+    return summary
+
+
+def summarize_routes(samples, wall):
+    routes = {}
+    for sample in samples:
+        routes.setdefault(sample[0], []).append(sample)
+    return {route: summarize(route_samples, wall) for route, route_samples in sorted(routes.items())}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(data_dir, port, threads, python, timeout):
+    env = dict(os.environ, LOCALAPPDATA=data_dir)
+    command = [python, 'app.py', 'serve', '--host', '127.0.0.1', '--port', str(port)]
+    if threads:
+        command += ['--threads', str(threads)]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with code {process.returncode}')
+        if port_in_use(port):
+            return process
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f'server did not listen on port {port} within {timeout}s')
+
+
+def print_results(results):
+    run = results['run']
+    print(f"\n{run['target']}, {run['workers']} worker(s), mix {run['mix']}")
+    dataset = results['dataset']
+    print(f"Dataset: {dataset['users']} users, {dataset['tools']} tools, {dataset['transactions']} transactions "
+          f"({dataset['open_loans']} open), {dataset['logs']} log rows")
+    print(f"{'route':<12} {'requests':>8} {'errors':>6} {'req/s':>8} {'mean':>8} {'p50':>8} {'p95':>8} "
+          f"{'p99':>8} {'max':>8} {'queries':>8}")
+    for route, summary in list(results['routes'].items()) + [('total', results['total'])]:
+        latency = summary['latency_ms']
+        queries = summary['queries']['mean'] if summary['queries'] else '-'
+        print(f"{route:<12} {summary['requests']:>8} {summary['errors']:>6} {summary['throughput_rps']:>8} "
+              f"{latency['mean']:>8} {latency['p50']:>8} {latency['p95']:>8} {latency['p99']:>8} "
+              f"{latency['max']:>8} {queries:>8}")
+    print('Latencies in ms; queries are per request.')
+
+
+def print_comparison(results, previous):
+    print(f"\nCompared with {previous['run'].get('git_commit') or 'the previous run'} "
+          f"({previous['run']['started_at']}):")
+    print(f"{'route':<12} {'p50 ms':>18} {'p95 ms':>18} {'req/s':>18}")
+    routes = dict(results['routes'], total=results['total'])
+    before_routes = dict(previous['routes'], total=previous['total'])
+    for route, summary in routes.items():
+        before = before_routes.get(route)
+        if before is None:
+            continue
+        cells = []
+        for old, new in ((before['latency_ms']['p50'], summary['latency_ms']['p50']),
+                         (before['latency_ms']['p95'], summary['latency_ms']['p95']),
+                         (before['throughput_rps'], summary['throughput_rps'])):
+            change = f'{(new - old) / old * 100:+.0f}%' if old else '-'
+            cells.append(f'{old} -> {new} {change}')
+        print(f"{route:<12} {cells[0]:>18} {cells[1]:>18} {cells[2]:>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive lend, return, inventory and log traffic against ToolTracker.')
+    add_size_arguments(parser)
+    parser.add_argument('--data-dir', help='keep the seeded data here and reuse it on later runs '
+                                           '(default: a temporary folder, removed afterwards)')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f"weighted actions, from {', '.join(ACTIONS)} (default {DEFAULT_MIX})")
+    parser.add_argument('--workers', type=int, default=8, help='concurrent clients, each logged in as its own user')
+    parser.add_argument('--requests', type=int, default=2000, help='measured requests across all workers')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per worker first')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='send If-None-Match with the last ETag, as a browser revisiting a page does')
+    parser.add_argument('--server', action='store_true',
+                        help='start "app.py serve" and go through HTTPS instead of the Flask test client')
+    parser.add_argument('--port', type=int, default=5055, help='port for --server')
+    parser.add_argument('--threads', type=int, help='server threads for --server')
+    parser.add_argument('--python', default=sys.executable)
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for --server to start')
+    parser.add_argument('--output', help='results file (default benchmarks/results/workload-<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON instead of a table')
+    args = parser.parse_args()
+
+    try:
+        options = dataset_options(args)
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.workers < 1 or args.requests < 1:
+        parser.error('--workers and --requests must be at least 1')
+    if args.workers > options['users']:
+        parser.error(f"--workers is larger than the {options['users']} seeded users")
+    if args.server and port_in_use(args.port):
+        parser.error(f'port {args.port} is already in use')
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+
+    data_dir = os.path.abspath(args.data_dir) if args.data_dir else tempfile.mkdtemp(prefix='tooltracker-bench-')
+    os.makedirs(data_dir, exist_ok=True)
+    server = None
+    try:
+        app = create_bench_app(data_dir)
+        path = database_path(data_dir)
+        if is_seeded(app):
+            print(f'Reusing the data in {path}')
+            seeding = None
+        else:
+            seeding = seed_database(app, **options)
+        dataset = dataset_counts(path)
+        if args.workers > dataset['users']:
+            parser.error(f"--workers is larger than the {dataset['users']} users in {path}")
+
+        started_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        if args.server:
+            server = start_server(data_dir, args.port, args.threads, args.python, args.timeout)
+            samples, wall = run_workers(lambda: HttpSession('127.0.0.1', args.port), path, args.workers,
+                                        args.requests, args.warmup, mix, args.seed, revalidate=args.revalidate)
+        else:
+            counter = QueryCounter()
+            counter.install(app)
+            samples, wall = run_workers(lambda: TestClientSession(app), path, args.workers, args.requests,
+                                        args.warmup, mix, args.seed, counter, args.revalidate)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    results = {
+        'run': {
+            'started_at': started_at,
+            'git_commit': git_commit(),
+            'target': f'server 127.0.0.1:{args.port}' if args.server else 'test client',
+            'workers': args.workers,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'mix': ','.join(f'{name}={weight:g}' for name, weight in mix),
+            'revalidate': args.revalidate,
+            'seed': args.seed,
+            'wall_seconds': round(wall, 3),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'dataset': dict(dataset, seeding=seeding),
+        'routes': summarize_routes(samples, wall),
+        'total': summarize(samples, wall),
+    }
+
+    output = args.output or os.path.join(RESULTS_PATH, f"workload-{started_at.replace(':', '')[:17]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+        print(f'Results written to {output}')
+    if previous is not None:
+        print_comparison(results, previous)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,16 @@
 from flask import Flask
+from sqlalchemy import event
 from models import db
+from schema import upgrade_database
+from backups import start_backup_scheduler
+from audit import start_audit_writer
+from retention import start_retention_scheduler
+from analytics import start_rollup_backfill
+from page_cache import install_data_version
+from static_assets import install_static_assets
 import views
 import admin
+import api
 import os
 import subprocess
 import urllib.request
@@ -9,6 +18,8 @@ import zipfile
 import ssl
 import sys
 import socket
+import threading
+import logging
 
 def download_openssl(openssl_dir):
     openssl_url = 'https://download.firedaemon.com/FireDaemon-OpenSSL/openssl-3.3.1.zip'
@@ -35,6 +46,84 @@ def download_openssl(openssl_dir):
         print("OpenSSL downloaded and extracted successfully.")
 
 
+# Pragmas run on every new SQLite connection. WAL lets kiosk reads carry on while a lend/return writes.
+STORAGE_PROFILES = {
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,
+        'temp_store': 'MEMORY',
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+    },
+    'legacy': {
+        'busy_timeout': 5000,
+    },
+}
+
+
+def configure_storage(app):
+    profile = app.config.get('STORAGE_PROFILE', 'performance')
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {profile}")
+    pragmas = dict(STORAGE_PROFILES[profile])
+    pragmas.update(app.config.get('SQLITE_PRAGMAS', {}))
+    app.config['SQLITE_PRAGMAS'] = pragmas
+
+    busy_timeout = pragmas.get('busy_timeout', 5000) / 1000
+    engine_options = {
+        'pool_size': app.config.get('DB_POOL_SIZE', 10),
+        'max_overflow': app.config.get('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': app.config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': app.config.get('DB_POOL_RECYCLE', 3600),
+        # The web server threads and the console loop share connections from one pool
+        'connect_args': {'timeout': busy_timeout, 'check_same_thread': False},
+    }
+    engine_options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+
+def install_sqlite_pragmas(app):
+    pragmas = app.config['SQLITE_PRAGMAS']
+
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    with app.app_context():
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
+
+
+def start_background_task(name, target, *args):
+    def run():
+        try:
+            target(*args)
+        except Exception as e:
+            print(f"Background task {name} failed: {e}")
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def configure_logging(app):
+    logger = logging.getLogger('tooltracker')
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        # Audit lines carry their own timestamp
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(app.config['LOG_LEVEL'])
+
+
 def get_self_ip():
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -52,19 +141,20 @@ def create_app():
     DATABASE_PATH = os.path.join(BASE_DIR, 'database', 'app.db')
     QR_CODES_PATH = os.path.join(BASE_DIR, 'qr_codes')
     BACKUPS_PATH = os.path.join(BASE_DIR, 'backups')
+    ARCHIVE_PATH = os.path.join(BASE_DIR, 'archive')
+    STATIC_ASSETS_PATH = os.path.join(BASE_DIR, 'static')
     CERTS_PATH = os.path.join(BASE_DIR, 'certs')
     OPENSSL_DIR = os.path.join(BASE_DIR, 'openssl')
 
     os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
     os.makedirs(QR_CODES_PATH, exist_ok=True)
+    os.makedirs(BACKUPS_PATH, exist_ok=True)
+    os.makedirs(ARCHIVE_PATH, exist_ok=True)
+    os.makedirs(STATIC_ASSETS_PATH, exist_ok=True)
     os.makedirs(CERTS_PATH, exist_ok=True)
     os.makedirs(OPENSSL_DIR, exist_ok=True)
 
-    # Check if OpenSSL is present and download if not
     openssl_executable = os.path.join(OPENSSL_DIR, 'openssl', 'openssl-3', 'x64', 'bin', 'openssl.exe')
-    if not os.path.exists(openssl_executable):
-        download_openssl(OPENSSL_DIR)
-
     certificate_path = os.path.join(CERTS_PATH, 'certificate.pem')
     key_path = os.path.join(CERTS_PATH, 'key.pem')
 
@@ -72,9 +162,14 @@ def create_app():
         print(f"Certificate or key file not found. Please create 'certificate.pem' and 'key.pem' in the folder: {CERTS_PATH}")
         choice = input("Do you want assistance with creating these files? (yes/no): ").strip().lower()
         if choice == 'yes':
+            if not os.path.exists(openssl_executable):
+                download_openssl(OPENSSL_DIR)
             create_certificate_and_key(certificate_path, key_path, openssl_executable)
         else:
             input("Press Enter after you have placed the files in the folder...")
+    elif not os.path.exists(openssl_executable):
+        # Only needed to re-create certificates later, so it must not hold up the server
+        start_background_task('openssl-download', download_openssl, OPENSSL_DIR)
 
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'supersecretkey'
@@ -82,16 +177,71 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['QR_CODES_PATH'] = QR_CODES_PATH
     app.config['BACKUPS_PATH'] = BACKUPS_PATH
+    app.config['BACKUP_COMPRESS'] = True
+    app.config['BACKUP_INTERVAL_HOURS'] = 24
+    app.config['BACKUP_RETENTION_COUNT'] = 30
+    app.config['BACKUP_RETENTION_DAYS'] = 90
+    app.config['BACKUP_PAGES_PER_STEP'] = 256
+    app.config['ARCHIVE_PATH'] = ARCHIVE_PATH
+    # Logs and returned loans older than this move to monthly files in ARCHIVE_PATH; None keeps everything hot
+    app.config['LOG_RETENTION_DAYS'] = 365
+    app.config['RETENTION_INTERVAL_HOURS'] = 24
+    # Loans open longer than this show up as overdue in the analytics
+    app.config['LOAN_PERIOD_DAYS'] = 14
+    app.config['STATIC_ASSETS_PATH'] = STATIC_ASSETS_PATH
+    # Rendered lists are reused for this many seconds unless the data changes first; 0 turns it off
+    app.config['FRAGMENT_CACHE_TTL'] = 5
+    # Scanners retrying a write with the same Idempotency-Key get the first reply for at least this long
+    app.config['IDEMPOTENCY_KEY_HOURS'] = 24
+    # A key still unanswered after this long belongs to a request that died; a retry takes it over
+    app.config['IDEMPOTENCY_LEASE_SECONDS'] = 60
     app.config['CERTS_PATH'] = CERTS_PATH
     app.config['OPENSSL_DIR'] = OPENSSL_DIR
+    # Unset: a random key is made on first start and kept in CERTS_PATH
+    app.config['QR_SIGNING_KEY'] = os.getenv('TOOLTRACKER_QR_SIGNING_KEY')
+    app.config['QR_DECODE_WORKERS'] = None
+    app.config['QR_MAX_DIMENSION'] = 1600
+    app.config['QR_RENDER_WORKERS'] = None
+    app.config['LABEL_SHEET_DPI'] = 300
+    app.config['IMPORT_HASH_WORKERS'] = None
+    app.config['STORAGE_PROFILE'] = os.getenv('TOOLTRACKER_STORAGE_PROFILE', 'performance')
+    app.config['SQLITE_PRAGMAS'] = {}
+    app.config['DB_POOL_SIZE'] = 10
+    app.config['DB_MAX_OVERFLOW'] = 20
+    app.config['DB_POOL_TIMEOUT'] = 30
+    app.config['SERVER_HOST'] = os.getenv('TOOLTRACKER_HOST', '0.0.0.0')
+    app.config['SERVER_PORT'] = int(os.getenv('TOOLTRACKER_PORT', 5000))
+    # Each open live-log page holds a thread; keep this within DB_POOL_SIZE + DB_MAX_OVERFLOW
+    app.config['SERVER_THREADS'] = int(os.getenv('TOOLTRACKER_SERVER_THREADS', 24))
+    app.config['SERVER_BACKLOG'] = 64
+    app.config['SERVER_TIMEOUT'] = 30
+    app.config['SERVER_KEEP_ALIVE_CONNECTIONS'] = 50
+    app.config['SERVER_SHUTDOWN_TIMEOUT'] = 5
+    app.config['LOG_LEVEL'] = os.getenv('TOOLTRACKER_LOG_LEVEL', 'INFO').upper()
+    # Sync writes each audit row before lend/return returns; meant for tests and scripts (TOOLTRACKER_AUDIT_LOG_SYNC=1)
+    app.config['AUDIT_LOG_SYNC'] = os.getenv('TOOLTRACKER_AUDIT_LOG_SYNC', '').lower() in ('1', 'true', 'yes')
+    app.config['AUDIT_QUEUE_SIZE'] = 10000
+    app.config['AUDIT_BATCH_SIZE'] = 500
+    app.config['AUDIT_FLUSH_INTERVAL'] = 0.2
+
+    configure_logging(app)
+    configure_storage(app)
 
     db.init_app(app)
+    install_sqlite_pragmas(app)
+    install_data_version(app)
 
-    with app.app_context():
-        db.create_all()
+    upgrade_database(app)
+    start_backup_scheduler(app)
+    start_audit_writer(app)
+    start_retention_scheduler(app)
+    # Databases upgraded to the rollup tables fill them once, in the background
+    start_rollup_backfill(app)
 
     app.register_blueprint(views.views_bp)
     app.register_blueprint(admin.admin_bp)
+    app.register_blueprint(api.api_bp)
+    install_static_assets(app, start_background_task)
 
     return app
 
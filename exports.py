@@ -0,0 +1,164 @@
+import csv
+import io
+import json
+from sqlalchemy import select
+from models import db, Tool, User, Transaction, ToolLog, TransactionArchive
+from retention import find_archives, get_archive_engine
+from tool_logs import LOG_COLUMNS, filter_logs, parse_date
+
+BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    'txt': 'text/plain',
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+LOG_FIELDS = ['id', 'timestamp', 'user', 'tool', 'action', 'details']
+TRANSACTION_FIELDS = ['id', 'user', 'tool', 'borrow_date', 'return_date', 'duration_seconds']
+
+
+def format_datetime(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+
+def iter_batches(statement, batch_size=BATCH_SIZE, connection=None):
+    # yield_per keeps a single cursor open and fetches batch_size rows at a time
+    result = (connection or db.session).execute(statement.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield partition
+
+
+def iter_archive_batches(statement, batch_size, start=None, end=None):
+    # Newest month first, continuing the order of the hot table
+    for month, month_end, path in find_archives(start, end):
+        with get_archive_engine(path).connect() as connection:
+            yield from iter_batches(statement, batch_size, connection)
+
+
+def log_row(row):
+    return {
+        'id': row.id,
+        'timestamp': format_datetime(row.timestamp),
+        'user': row.username,
+        'tool': row.tool_name,
+        'action': row.action,
+        'details': row.details,
+    }
+
+
+def iter_log_batches(batch_size=BATCH_SIZE, **filters):
+    statement = filter_logs(select(*LOG_COLUMNS), **filters).order_by(ToolLog.timestamp.desc(), ToolLog.id.desc())
+    for rows in iter_batches(statement, batch_size):
+        yield [log_row(row) for row in rows]
+    for rows in iter_archive_batches(statement, batch_size, filters.get('start'), filters.get('end')):
+        yield [log_row(row) for row in rows]
+
+
+def parse_transaction_filters(args):
+    filters = {key: args.get(key, '').strip() for key in ('user', 'tool', 'start', 'end', 'status')}
+    filters = {key: value for key, value in filters.items() if value}
+    if 'start' in filters:
+        filters['start'] = parse_date(filters['start'])
+    if 'end' in filters:
+        filters['end'] = parse_date(filters['end'], end=True)
+    return filters
+
+
+def filter_transactions(statement, user=None, tool=None, start=None, end=None, status=None):
+    if user:
+        statement = statement.filter(User.username == user)
+    if tool:
+        statement = statement.filter(Tool.name == tool)
+    if start:
+        statement = statement.filter(Transaction.borrow_date >= start)
+    if end:
+        statement = statement.filter(Transaction.borrow_date < end)
+    if status == 'open':
+        statement = statement.filter(Transaction.return_date.is_(None))
+    elif status == 'closed':
+        statement = statement.filter(Transaction.return_date.isnot(None))
+    return statement
+
+
+def filter_archived_transactions(statement, user=None, tool=None, start=None, end=None, status=None):
+    if user:
+        statement = statement.filter(TransactionArchive.username == user)
+    if tool:
+        statement = statement.filter(TransactionArchive.tool_name == tool)
+    if start:
+        statement = statement.filter(TransactionArchive.borrow_date >= start)
+    if end:
+        statement = statement.filter(TransactionArchive.borrow_date < end)
+    return statement
+
+
+def transaction_row(row):
+    return {
+        'id': row.id,
+        'user': row.username,
+        'tool': row.name,
+        'borrow_date': format_datetime(row.borrow_date),
+        'return_date': format_datetime(row.return_date),
+        'duration_seconds': int((row.return_date - row.borrow_date).total_seconds()) if row.return_date else None,
+    }
+
+
+def iter_transaction_batches(batch_size=BATCH_SIZE, **filters):
+    statement = select(Transaction.id, User.username, Tool.name, Transaction.borrow_date, Transaction.return_date) \
+        .join(User, Transaction.user_id == User.id) \
+        .join(Tool, Transaction.tool_id == Tool.id)
+    statement = filter_transactions(statement, **filters).order_by(Transaction.borrow_date.desc(), Transaction.id.desc())
+    for rows in iter_batches(statement, batch_size):
+        yield [transaction_row(row) for row in rows]
+
+    # Only returned loans are ever archived
+    if filters.get('status') == 'open':
+        return
+    statement = select(TransactionArchive.id, TransactionArchive.username, TransactionArchive.tool_name.label('name'),
+                       TransactionArchive.borrow_date, TransactionArchive.return_date)
+    statement = filter_archived_transactions(statement, **filters) \
+        .order_by(TransactionArchive.borrow_date.desc(), TransactionArchive.id.desc())
+    # Loans of removed tools and users, still in the main database, then the monthly retention files
+    for rows in iter_batches(statement, batch_size):
+        yield [transaction_row(row) for row in rows]
+    for rows in iter_archive_batches(statement, batch_size, filters.get('start'), filters.get('end')):
+        yield [transaction_row(row) for row in rows]
+
+
+def log_text_line(row):
+    return f"{row['timestamp']} - {row['user']} - {row['tool']} - Action: {row['action']} - Details: {row['details'] or 'None'}"
+
+
+def transaction_text_line(row):
+    if row['return_date'] is None:
+        return f"{row['borrow_date']} - not returned - {row['user']} - {row['tool']}"
+    return f"{row['borrow_date']} - {row['return_date']} - {row['user']} - {row['tool']} - Duration: {row['duration_seconds']}s"
+
+
+def stream_export(batches, export_format, fields, text_line):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+        for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif export_format == 'ndjson':
+        for rows in batches:
+            yield ''.join(json.dumps(row) + '\n' for row in rows)
+    else:
+        for rows in batches:
+            yield ''.join(text_line(row) + '\n' for row in rows)
+
+
+def stream_logs_export(export_format='txt', **filters):
+    return stream_export(iter_log_batches(**filters), export_format, LOG_FIELDS, log_text_line)
+
+
+def stream_transactions_export(export_format='txt', **filters):
+    return stream_export(iter_transaction_batches(**filters), export_format, TRANSACTION_FIELDS, transaction_text_line)
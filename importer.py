@@ -0,0 +1,222 @@
+import csv
+import io
+import zipfile
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from models import db, Tool, User
+from auth import invalidate_user_roles
+from workers import get_process_pool
+
+IMPORT_KINDS = ('tools', 'users')
+IMPORT_BATCH_SIZE = 500
+MAX_REPORTED_PROBLEMS = 200
+# Hashing a handful of passwords is quicker than handing them to the pool
+INLINE_HASH_THRESHOLD = 8
+TRUE_VALUES = ('1', 'yes', 'true', 'y', 'ano', 'x')
+
+
+def iter_csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            # Spreadsheets set to a European locale export with ';'
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(text, dialect=dialect)
+        for row in reader:
+            yield {(key or '').strip().lower(): (value or '').strip() for key, value in row.items() if key}
+    except csv.Error as e:
+        raise ValueError(f"The CSV file is malformed after line {reader.line_num}: {e}. "
+                         "Save it again from the spreadsheet as CSV (UTF-8).") from e
+    except UnicodeDecodeError as e:
+        raise ValueError("The CSV file is not UTF-8 text. Save it again from the spreadsheet as CSV (UTF-8).") from e
+
+
+def iter_xlsx_rows(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ValueError("Importing .xlsx files needs the openpyxl package; save the sheet as CSV instead.") from e
+    from openpyxl.utils.exceptions import InvalidFileException
+    try:
+        # read_only streams the sheet row by row instead of building the whole workbook
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(cell or '').strip().lower() for cell in next(rows, ())]
+            for values in rows:
+                if values is None or all(value is None for value in values):
+                    continue
+                yield {key: '' if value is None else str(value).strip() for key, value in zip(header, values) if key}
+        finally:
+            workbook.close()
+    except (zipfile.BadZipFile, InvalidFileException, KeyError, SyntaxError) as e:
+        # A damaged zip, a missing part or broken sheet XML (ParseError is a SyntaxError)
+        raise ValueError("The file is not a readable .xlsx workbook. Open it in the spreadsheet and save it "
+                         "again as .xlsx, or export it as CSV.") from e
+
+
+def iter_rows(filename, stream):
+    name = filename.lower()
+    if name.endswith('.xlsx'):
+        return iter_xlsx_rows(stream)
+    if name.endswith(('.csv', '.txt')):
+        return iter_csv_rows(stream)
+    raise ValueError(f"Unsupported file type: {filename}. Use .csv or .xlsx.")
+
+
+def iter_batches(rows, size=IMPORT_BATCH_SIZE):
+    batch = []
+    # Spreadsheet row numbers: the header is row 1
+    for number, row in enumerate(rows, start=2):
+        batch.append((number, row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ImportReport:
+    def __init__(self, kind, dry_run):
+        self.kind = kind
+        self.dry_run = dry_run
+        self.total = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.problems = []
+
+    def problem(self, number, message, duplicate=False):
+        if duplicate:
+            self.duplicates += 1
+        else:
+            self.invalid += 1
+        if len(self.problems) < MAX_REPORTED_PROBLEMS:
+            self.problems.append({'row': number, 'message': message})
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'dry_run': self.dry_run,
+            'total': self.total,
+            'imported': self.imported,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'problems': sorted(self.problems, key=lambda problem: problem['row']),
+            'problems_truncated': self.duplicates + self.invalid > len(self.problems),
+        }
+
+
+def check_required(report, number, row, fields):
+    for field, max_length in fields:
+        value = row.get(field, '')
+        if not value:
+            report.problem(number, f"Missing {field}")
+            return False
+        if len(value) > max_length:
+            report.problem(number, f"{field.capitalize()} is longer than {max_length} characters")
+            return False
+    return True
+
+
+def validate_tools(report, batch, seen):
+    candidates = [(number, row) for number, row in batch
+                  if check_required(report, number, row, (('name', 80), ('location', 120)))]
+    # One query per batch finds which of these tools already exist
+    names = {row['name'] for _, row in candidates}
+    existing = set(db.session.query(Tool.name, Tool.location).filter(Tool.name.in_(names))) if names else set()
+
+    valid = []
+    for number, row in candidates:
+        key = (row['name'], row['location'])
+        if key in existing:
+            report.problem(number, f"Tool {row['name']} at {row['location']} already exists", duplicate=True)
+        elif key in seen:
+            report.problem(number, f"Tool {row['name']} at {row['location']} is listed twice", duplicate=True)
+        else:
+            seen.add(key)
+            valid.append({'name': row['name'], 'location': row['location'], 'qr_code': None})
+    return valid
+
+
+def validate_users(report, batch, seen):
+    candidates = [(number, row) for number, row in batch
+                  if check_required(report, number, row, (('username', 80), ('password', 1024)))]
+    usernames = {row['username'] for _, row in candidates}
+    existing = {username for username, in db.session.query(User.username).filter(User.username.in_(usernames))} \
+        if usernames else set()
+
+    valid = []
+    for number, row in candidates:
+        username = row['username']
+        if username in existing:
+            report.problem(number, f"User {username} already exists", duplicate=True)
+        elif username in seen:
+            report.problem(number, f"User {username} is listed twice", duplicate=True)
+        else:
+            seen.add(username)
+            valid.append({'username': username, 'password': row['password'],
+                          'is_admin': row.get('is_admin', '').lower() in TRUE_VALUES})
+    return valid
+
+
+def hash_passwords(passwords, workers=None):
+    if len(passwords) < INLINE_HASH_THRESHOLD:
+        return [generate_password_hash(password) for password in passwords]
+    # Key stretching is deliberately slow, so spread it over every core
+    return list(get_process_pool('import_hash', workers).map(generate_password_hash, passwords, chunksize=8))
+
+
+def prepare_tools(valid, workers=None):
+    return valid
+
+
+def prepare_users(valid, workers=None):
+    hashes = hash_passwords([user.pop('password') for user in valid], workers)
+    return [dict(user, password_hash=password_hash) for user, password_hash in zip(valid, hashes)]
+
+
+IMPORTERS = {
+    'tools': (validate_tools, prepare_tools, Tool),
+    'users': (validate_users, prepare_users, User),
+}
+
+
+def import_rows(kind, rows, dry_run=False, workers=None):
+    if kind not in IMPORTERS:
+        raise ValueError(f"Unknown import kind: {kind}")
+    validate, prepare, model = IMPORTERS[kind]
+    report = ImportReport(kind, dry_run)
+    seen = set()
+    staged = []
+
+    try:
+        for batch in iter_batches(rows):
+            report.total += len(batch)
+            valid = validate(report, batch, seen)
+            report.imported += len(valid)
+            if valid and not dry_run:
+                # Password hashing takes seconds per batch, so it runs before the first INSERT takes the write lock
+                staged.append(prepare(valid, workers))
+        if dry_run:
+            db.session.rollback()
+        else:
+            # All batches land in one short transaction: a file that fails halfway leaves nothing behind
+            for rows_to_insert in staged:
+                db.session.execute(insert(model), rows_to_insert)
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if kind == 'users' and not dry_run:
+        invalidate_user_roles()
+    return report
+
+
+def import_file(kind, filename, stream, dry_run=False, workers=None):
+    return import_rows(kind, iter_rows(filename, stream), dry_run, workers)
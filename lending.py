@@ -0,0 +1,131 @@
+import datetime
+from sqlalchemy import and_, bindparam, insert, update
+from sqlalchemy.exc import IntegrityError
+from models import db, Tool, User, Transaction
+from audit import build_log_values, record_events
+from analytics import Loan, record_returns
+from availability import invalidate_availability
+from utils import loan_duration, format_duration
+
+
+def parse_tool_ids(values):
+    tool_ids = []
+    for value in values:
+        try:
+            tool_id = int(value)
+        except (TypeError, ValueError):
+            continue
+        if tool_id not in tool_ids:
+            tool_ids.append(tool_id)
+    return tool_ids
+
+
+def outcome(tool_id, tool_name, status, message, category):
+    return {'tool_id': tool_id, 'tool_name': tool_name, 'status': status, 'message': message, 'category': category}
+
+
+def checkout_tools(user_id, tool_ids, retry=True):
+    tool_ids = parse_tool_ids(tool_ids)
+    user = db.session.get(User, user_id)
+    if user is None:
+        return [outcome(tool_id, None, 'no_user', 'User not found', 'danger') for tool_id in tool_ids]
+
+    # One query answers "does it exist" and "is it already out" for the whole cart
+    rows = db.session.query(Tool, Transaction.id) \
+        .outerjoin(Transaction, and_(Transaction.tool_id == Tool.id, Transaction.return_date.is_(None))) \
+        .filter(Tool.id.in_(tool_ids)) \
+        .all()
+    tools = {tool.id: (tool, open_transaction_id) for tool, open_transaction_id in rows}
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    results = []
+    lent_tools = []
+    for tool_id in tool_ids:
+        if tool_id not in tools:
+            results.append(outcome(tool_id, None, 'not_found', 'Tool not found', 'danger'))
+            continue
+        tool, open_transaction_id = tools[tool_id]
+        if open_transaction_id is not None:
+            results.append(outcome(tool_id, tool.name, 'unavailable', f'Tool {tool.name} is already lent out', 'danger'))
+            continue
+        lent_tools.append(tool)
+        results.append(outcome(tool_id, tool.name, 'lent', f'Tool {tool.name} lent successfully', 'success'))
+
+    if lent_tools:
+        try:
+            # Plain executemany inserts; the ORM would issue one INSERT ... RETURNING per row on SQLite.
+            # The triggers from migration 0007 set tool.rented_by in the same transaction
+            db.session.execute(insert(Transaction), [
+                {'user_id': user.id, 'tool_id': tool.id, 'borrow_date': now} for tool in lent_tools
+            ])
+            db.session.commit()
+        except IntegrityError:
+            # Another request lent one of these tools since the check above; the unique open-loan index refused it
+            db.session.rollback()
+            if not retry:
+                raise
+            return checkout_tools(user_id, tool_ids, retry=False)
+        invalidate_availability()
+        # The audit rows are written by the background writer, off the request path
+        record_events([build_log_values("LEND", user, tool, now=now) for tool in lent_tools])
+
+    return results
+
+
+def checkin_tools(tool_ids):
+    tool_ids = parse_tool_ids(tool_ids)
+
+    rows = db.session.query(Tool, Transaction, User) \
+        .outerjoin(Transaction, and_(Transaction.tool_id == Tool.id, Transaction.return_date.is_(None))) \
+        .outerjoin(User, Transaction.user_id == User.id) \
+        .filter(Tool.id.in_(tool_ids)) \
+        .all()
+    tools = {}
+    for tool, transaction, user in rows:
+        # Should there ever be several open loans for one tool, close them all
+        tools.setdefault(tool.id, (tool, []))[1].append((transaction, user))
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    open_loans = [transaction.id for tool, loans in tools.values() for transaction, user in loans
+                  if transaction is not None]
+    closed = set()
+    if open_loans:
+        # A concurrent return of the same tool may have closed the loan since the read; only rows changed here count
+        closed = set(db.session.execute(update(Transaction)
+                                        .where(Transaction.id.in_(open_loans), Transaction.return_date.is_(None))
+                                        .values(return_date=now)
+                                        .returning(Transaction.id)).scalars())
+
+    results = []
+    returned_loans = []
+    log_entries = []
+    for tool_id in tool_ids:
+        if tool_id not in tools:
+            results.append(outcome(tool_id, None, 'not_found', 'Tool not found', 'danger'))
+            continue
+        tool, loans = tools[tool_id]
+        loans = [(transaction, user) for transaction, user in loans if transaction is not None and transaction.id in closed]
+        if not loans:
+            results.append(outcome(tool_id, tool.name, 'not_lent', f'No active lending record found for tool {tool.name}', 'danger'))
+            continue
+        for transaction, user in loans:
+            duration = loan_duration(transaction.borrow_date, now)
+            returned_loans.append((transaction, round(duration.total_seconds())))
+            if user is not None:
+                log_entries.append(build_log_values("RETURN", user, tool, format_duration(duration), now=now))
+        results.append(outcome(tool_id, tool.name, 'returned', f'Tool {tool.name} returned successfully', 'success'))
+
+    if returned_loans:
+        db.session.execute(update(Transaction.__table__)
+                           .where(Transaction.__table__.c.id == bindparam('transaction_id'))
+                           .values(duration_seconds=bindparam('seconds')),
+                           [{'transaction_id': transaction.id, 'seconds': seconds}
+                            for transaction, seconds in returned_loans])
+        record_returns([Loan(transaction.tool_id, transaction.user_id, transaction.borrow_date, now, seconds)
+                        for transaction, seconds in returned_loans])
+    db.session.commit()
+    if returned_loans:
+        invalidate_availability()
+        record_events(log_entries)
+
+    return results
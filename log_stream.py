@@ -0,0 +1,80 @@
+import json
+import threading
+from models import db, ToolLog
+from tool_logs import log_to_dict
+
+HEARTBEAT_SECONDS = 15
+BACKFILL_LIMIT = 500
+
+
+class LogChannel:
+    # Subscribers only get woken up; what changed is read from the table, from their last id
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        wakeup = threading.Event()
+        with self._lock:
+            self._subscribers.add(wakeup)
+        return wakeup
+
+    def unsubscribe(self, wakeup):
+        with self._lock:
+            self._subscribers.discard(wakeup)
+
+    def wake(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for wakeup in subscribers:
+            wakeup.set()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+log_channel = LogChannel()
+
+
+def notify_new_logs():
+    # Bulk writers don't know their row ids; subscribers re-read from their last id instead
+    if log_channel.subscriber_count():
+        log_channel.wake()
+
+
+def format_event(entry):
+    return f"id: {entry['id']}\nevent: log\ndata: {json.dumps(entry)}\n\n"
+
+
+def get_latest_log_id():
+    return db.session.query(db.func.max(ToolLog.id)).scalar() or 0
+
+
+def logs_since(last_id, limit=BACKFILL_LIMIT):
+    logs = ToolLog.query.filter(ToolLog.id > last_id).order_by(ToolLog.id).limit(limit).all()
+    entries = [log_to_dict(log) for log in logs]
+    # Release the connection; the stream may stay open for hours
+    db.session.remove()
+    return entries
+
+
+def stream_logs(last_id=0):
+    # Subscribe before the backfill so nothing written in between is missed
+    wakeup = log_channel.subscribe()
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            wakeup.clear()
+            while True:
+                entries = logs_since(last_id)
+                for entry in entries:
+                    last_id = entry['id']
+                    yield format_event(entry)
+                if len(entries) < BACKFILL_LIMIT:
+                    break
+
+            while not wakeup.wait(HEARTBEAT_SECONDS):
+                yield ": keepalive\n\n"
+    finally:
+        log_channel.unsubscribe(wakeup)
@@ -0,0 +1,64 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-07-01 00:00:00
+
+Databases created before migrations existed already have these tables
+(from db.create_all()), so each table is only created when missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'tool' not in existing:
+        op.create_table(
+            'tool',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(80), nullable=False),
+            sa.Column('location', sa.String(120), nullable=False),
+            sa.Column('qr_code', sa.String(120), nullable=True),
+            sa.Column('rented_by', sa.String(80), nullable=True),
+        )
+    if 'user' not in existing:
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('username', sa.String(80), nullable=False, unique=True),
+            sa.Column('password_hash', sa.String(120), nullable=False),
+            sa.Column('is_admin', sa.Boolean(), nullable=True),
+        )
+    if 'transaction' not in existing:
+        op.create_table(
+            'transaction',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), nullable=False),
+            sa.Column('tool_id', sa.Integer(), sa.ForeignKey('tool.id'), nullable=False),
+            sa.Column('borrow_date', sa.DateTime(), nullable=False),
+            sa.Column('return_date', sa.DateTime(), nullable=True),
+        )
+    if 'tool_log' not in existing:
+        op.create_table(
+            'tool_log',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('tool_name', sa.String(100), nullable=False),
+            sa.Column('username', sa.String(100), nullable=False),
+            sa.Column('action', sa.String(50), nullable=False),
+            sa.Column('timestamp', sa.DateTime(), nullable=False),
+            sa.Column('details', sa.Text(), nullable=True),
+        )
+
+
+def downgrade():
+    op.drop_table('tool_log')
+    op.drop_table('transaction')
+    op.drop_table('user')
+    op.drop_table('tool')
@@ -0,0 +1,35 @@
+"""indexes on hot lookup columns
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-07-08 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_tool_name', 'tool', ['name'])
+    op.create_index('ix_transaction_open_tool_id', 'transaction', ['tool_id'],
+                    sqlite_where=sa.text('return_date IS NULL'))
+    op.create_index('ix_transaction_open_user_id', 'transaction', ['user_id'],
+                    sqlite_where=sa.text('return_date IS NULL'))
+    op.create_index('ix_transaction_tool_id_borrow_date', 'transaction', ['tool_id', 'borrow_date'])
+    op.create_index('ix_tool_log_timestamp', 'tool_log', ['timestamp'])
+    op.create_index('ix_tool_log_username_timestamp', 'tool_log', ['username', 'timestamp'])
+    op.execute('ANALYZE')
+
+
+def downgrade():
+    op.drop_index('ix_tool_log_username_timestamp', table_name='tool_log')
+    op.drop_index('ix_tool_log_timestamp', table_name='tool_log')
+    op.drop_index('ix_transaction_tool_id_borrow_date', table_name='transaction')
+    op.drop_index('ix_transaction_open_user_id', table_name='transaction')
+    op.drop_index('ix_transaction_open_tool_id', table_name='transaction')
+    op.drop_index('ix_tool_name', table_name='tool')
@@ -0,0 +1,25 @@
+"""store the QR token and a content hash of the rendered label on Tool
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-07-15 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('tool', sa.Column('qr_token', sa.String(64), nullable=True))
+    op.add_column('tool', sa.Column('qr_hash', sa.String(64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('tool') as batch_op:
+        batch_op.drop_column('qr_hash')
+        batch_op.drop_column('qr_token')
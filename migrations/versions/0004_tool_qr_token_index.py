@@ -0,0 +1,27 @@
+"""unique index on Tool.qr_token for signed QR label lookups
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-07-22 00:00:00
+
+"""
+from alembic import op
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tokens used to be drawn from a small alphabet; drop any duplicate so the
+    # unique index can be built. Those tools get a fresh token on the next regeneration.
+    op.execute(
+        "UPDATE tool SET qr_token = NULL WHERE qr_token IS NOT NULL AND id NOT IN "
+        "(SELECT MIN(id) FROM tool WHERE qr_token IS NOT NULL GROUP BY qr_token)"
+    )
+    op.create_index('ix_tool_qr_token', 'tool', ['qr_token'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_tool_qr_token', table_name='tool')
@@ -0,0 +1,54 @@
+"""FTS5 index over tool name and location, kept in sync by triggers
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-07-29 00:00:00
+
+"""
+from alembic import op
+from sqlalchemy.exc import OperationalError
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    try:
+        # External content table: the index holds only tokens, the text stays in tool
+        op.execute(
+            "CREATE VIRTUAL TABLE tool_fts USING fts5("
+            "name, location, content='tool', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    except OperationalError as e:
+        # SQLite built without FTS5; tool search falls back to LIKE
+        print(f"Full-text search unavailable, skipping the tool search index: {e}")
+        return
+
+    op.execute(
+        "CREATE TRIGGER tool_fts_insert AFTER INSERT ON tool BEGIN "
+        "INSERT INTO tool_fts(rowid, name, location) VALUES (new.id, new.name, new.location); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER tool_fts_delete AFTER DELETE ON tool BEGIN "
+        "INSERT INTO tool_fts(tool_fts, rowid, name, location) VALUES ('delete', old.id, old.name, old.location); "
+        "END"
+    )
+    # Only renames and moves touch the index, not every lend and return
+    op.execute(
+        "CREATE TRIGGER tool_fts_update AFTER UPDATE OF name, location ON tool BEGIN "
+        "INSERT INTO tool_fts(tool_fts, rowid, name, location) VALUES ('delete', old.id, old.name, old.location); "
+        "INSERT INTO tool_fts(rowid, name, location) VALUES (new.id, new.name, new.location); "
+        "END"
+    )
+    op.execute("INSERT INTO tool_fts(tool_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS tool_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS tool_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS tool_fts_insert")
+    op.execute("DROP TABLE IF EXISTS tool_fts")
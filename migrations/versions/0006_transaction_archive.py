@@ -0,0 +1,36 @@
+"""archive table for loans of removed tools and users
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-08-05 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'transaction_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(80), nullable=True),
+        sa.Column('tool_id', sa.Integer(), nullable=False),
+        sa.Column('tool_name', sa.String(80), nullable=True),
+        sa.Column('borrow_date', sa.DateTime(), nullable=False),
+        sa.Column('return_date', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    # Removing users looks up all of their loans, not just the open ones
+    op.create_index('ix_transaction_user_id_borrow_date', 'transaction', ['user_id', 'borrow_date'])
+
+
+def downgrade():
+    op.drop_index('ix_transaction_user_id_borrow_date', table_name='transaction')
+    op.drop_table('transaction_archive')
@@ -0,0 +1,62 @@
+"""one open loan per tool; tool.rented_by kept in step with transaction by triggers
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-08-12 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+RENTED_BY = (
+    "SELECT u.username FROM \"transaction\" AS t JOIN \"user\" AS u ON u.id = t.user_id "
+    "WHERE t.tool_id = tool.id AND t.return_date IS NULL"
+)
+
+
+def upgrade():
+    # A tool lent again without being returned: the older loan ended when the newer one began
+    op.execute(
+        "UPDATE \"transaction\" SET return_date = ("
+        "SELECT MIN(newer.borrow_date) FROM \"transaction\" AS newer "
+        "WHERE newer.tool_id = \"transaction\".tool_id AND newer.return_date IS NULL AND newer.id > \"transaction\".id) "
+        "WHERE return_date IS NULL AND EXISTS ("
+        "SELECT 1 FROM \"transaction\" AS newer "
+        "WHERE newer.tool_id = \"transaction\".tool_id AND newer.return_date IS NULL AND newer.id > \"transaction\".id)"
+    )
+    op.drop_index('ix_transaction_open_tool_id', table_name='transaction')
+    op.create_index('ix_transaction_open_tool_id', 'transaction', ['tool_id'], unique=True,
+                    sqlite_where=sa.text('return_date IS NULL'))
+
+    # Open loans are the source of truth; rented_by is a copy the database maintains itself
+    op.execute(
+        "CREATE TRIGGER transaction_lend AFTER INSERT ON \"transaction\" WHEN new.return_date IS NULL BEGIN "
+        "UPDATE tool SET rented_by = (SELECT username FROM \"user\" WHERE id = new.user_id) WHERE id = new.tool_id; "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER transaction_return AFTER UPDATE OF return_date, tool_id, user_id ON \"transaction\" BEGIN "
+        f"UPDATE tool SET rented_by = ({RENTED_BY}) WHERE id IN (old.tool_id, new.tool_id); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER transaction_delete AFTER DELETE ON \"transaction\" WHEN old.return_date IS NULL BEGIN "
+        "UPDATE tool SET rented_by = NULL WHERE id = old.tool_id; "
+        "END"
+    )
+    # Rentals set on tool alone, without a loan behind them, are dropped here
+    op.execute(f"UPDATE tool SET rented_by = ({RENTED_BY})")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS transaction_delete")
+    op.execute("DROP TRIGGER IF EXISTS transaction_return")
+    op.execute("DROP TRIGGER IF EXISTS transaction_lend")
+    op.drop_index('ix_transaction_open_tool_id', table_name='transaction')
+    op.create_index('ix_transaction_open_tool_id', 'transaction', ['tool_id'],
+                    sqlite_where=sa.text('return_date IS NULL'))
@@ -0,0 +1,72 @@
+"""numeric loan duration and usage rollup tables
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-08-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def subject_columns():
+    return [
+        sa.Column('kind', sa.String(8), nullable=False),
+        sa.Column('subject_id', sa.Integer(), nullable=False),
+    ]
+
+
+def upgrade():
+    op.add_column('transaction', sa.Column('duration_seconds', sa.Integer(), nullable=True))
+    op.execute(
+        "UPDATE \"transaction\" SET duration_seconds = "
+        "CAST(ROUND((julianday(return_date) - julianday(borrow_date)) * 86400) AS INTEGER) "
+        "WHERE return_date IS NOT NULL"
+    )
+
+    op.create_table(
+        'usage_total',
+        *subject_columns(),
+        sa.Column('loans', sa.Integer(), nullable=False),
+        sa.Column('total_seconds', sa.Integer(), nullable=False),
+        sa.Column('max_seconds', sa.Integer(), nullable=False),
+        sa.Column('last_returned_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('kind', 'subject_id'),
+    )
+    op.create_table(
+        'usage_duration',
+        *subject_columns(),
+        sa.Column('bucket', sa.Integer(), nullable=False),
+        sa.Column('loans', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'subject_id', 'bucket'),
+    )
+    op.create_table(
+        'usage_hourly',
+        *subject_columns(),
+        sa.Column('hour', sa.Integer(), nullable=False),
+        sa.Column('loans', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'subject_id', 'hour'),
+    )
+    op.create_table(
+        'usage_daily',
+        *subject_columns(),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('loans', sa.Integer(), nullable=False),
+        sa.Column('total_seconds', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'subject_id', 'day'),
+    )
+    # The rollups are filled from the loan history by the backfill job on the next start
+
+
+def downgrade():
+    op.drop_table('usage_daily')
+    op.drop_table('usage_hourly')
+    op.drop_table('usage_duration')
+    op.drop_table('usage_total')
+    # Not batch mode: rebuilding the table would drop the availability triggers from 0007
+    op.execute("ALTER TABLE \"transaction\" DROP COLUMN duration_seconds")
@@ -5,10 +5,18 @@ import datetime
 db = SQLAlchemy()
 
 class Tool(db.Model):
+    __table_args__ = (
+        db.Index('ix_tool_name', 'name'),
+        db.Index('ix_tool_qr_token', 'qr_token', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     location = db.Column(db.String(120), nullable=False)
     qr_code = db.Column(db.String(120), nullable=True)
+    qr_token = db.Column(db.String(64), nullable=True)
+    qr_hash = db.Column(db.String(64), nullable=True)
+    # Maintained by triggers on transaction; never written directly
     rented_by = db.Column(db.String(80), nullable=True)
 
 class User(db.Model):
@@ -24,16 +32,97 @@ class User(db.Model):
         return check_password_hash(self.password_hash, password)
 
 class Transaction(db.Model):
+    __table_args__ = (
+        # Partial indexes: only open loans are looked up on the hot paths. A tool can only be out once,
+        # and triggers copy the borrower into tool.rented_by (migration 0007)
+        db.Index('ix_transaction_open_tool_id', 'tool_id', unique=True, sqlite_where=db.text('return_date IS NULL')),
+        db.Index('ix_transaction_open_user_id', 'user_id', sqlite_where=db.text('return_date IS NULL')),
+        db.Index('ix_transaction_tool_id_borrow_date', 'tool_id', 'borrow_date'),
+        db.Index('ix_transaction_user_id_borrow_date', 'user_id', 'borrow_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     tool_id = db.Column(db.Integer, db.ForeignKey('tool.id'), nullable=False)
     borrow_date = db.Column(db.DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
     return_date = db.Column(db.DateTime, nullable=True)
+    duration_seconds = db.Column(db.Integer, nullable=True)
 
 class ToolLog(db.Model):
+    __table_args__ = (
+        db.Index('ix_tool_log_timestamp', 'timestamp'),
+        db.Index('ix_tool_log_username_timestamp', 'username', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     tool_name = db.Column(db.String(100), nullable=False)
     username = db.Column(db.String(100), nullable=False)
     action = db.Column(db.String(50), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
     details = db.Column(db.Text, nullable=True)
+
+class TransactionArchive(db.Model):
+    # Loans of removed tools and users; names are copied because the rows they pointed to are gone
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    username = db.Column(db.String(80), nullable=True)
+    tool_id = db.Column(db.Integer, nullable=False)
+    tool_name = db.Column(db.String(80), nullable=True)
+    borrow_date = db.Column(db.DateTime, nullable=False)
+    return_date = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+# Loan rollups, updated on every return (analytics.py). kind is 'tool', 'user' or 'all' (subject_id 0)
+class UsageTotal(db.Model):
+    kind = db.Column(db.String(8), primary_key=True)
+    subject_id = db.Column(db.Integer, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    total_seconds = db.Column(db.Integer, nullable=False, default=0)
+    max_seconds = db.Column(db.Integer, nullable=False, default=0)
+    last_returned_at = db.Column(db.DateTime, nullable=True)
+
+class UsageDuration(db.Model):
+    # Loans per power-of-two duration bucket: enough to estimate the median without the raw rows
+    kind = db.Column(db.String(8), primary_key=True)
+    subject_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+
+class UsageHourly(db.Model):
+    # Hour of day (UTC) the loans started
+    kind = db.Column(db.String(8), primary_key=True)
+    subject_id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+
+class UsageDaily(db.Model):
+    # Day (UTC) the loans started
+    kind = db.Column(db.String(8), primary_key=True)
+    subject_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    total_seconds = db.Column(db.Integer, nullable=False, default=0)
+
+class ApiToken(db.Model):
+    # Only a hash is stored; the token itself is shown once, when it is created
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(80), nullable=False)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    last_used_at = db.Column(db.DateTime, nullable=True)
+
+class IdempotencyKey(db.Model):
+    # Replies to API writes, replayed when a scanner retries with the same Idempotency-Key
+    __table_args__ = (
+        db.Index('ix_idempotency_key_created_at', 'created_at'),
+    )
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(128), primary_key=True)
+    endpoint = db.Column(db.String(40), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    # Both stay empty while the first request is still being handled
+    status_code = db.Column(db.Integer, nullable=True)
+    response = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
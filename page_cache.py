@@ -0,0 +1,152 @@
+import hashlib
+import itertools
+import os
+import secrets
+import threading
+import time
+from functools import wraps
+from flask import current_app, make_response, render_template, request, session
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db
+
+FRAGMENT_CACHE_TTL = 5
+FRAGMENT_CACHE_SIZE = 256
+
+# A restart renders with new code and templates, so ETags from before it must not match
+_epoch = secrets.token_hex(4)
+_counter = itertools.count(1)
+_version = 0
+_version_lock = threading.Lock()
+_database_files = ()
+# Commits that wrote, waiting for the session's after_commit on the same thread
+_committed = threading.local()
+READ_STATEMENTS = ('SELECT', 'PRAGMA')
+
+
+def bump_data_version():
+    global _version
+    with _version_lock:
+        _version = next(_counter)
+    return _version
+
+
+def external_version():
+    # Another process (a separate console) writing the same file only shows up on disk.
+    # In WAL mode every commit grows or rewrites the -wal file
+    signature = []
+    for path in _database_files:
+        try:
+            stat = os.stat(path)
+            signature.append(f"{stat.st_mtime_ns:x}.{stat.st_size:x}")
+        except OSError:
+            signature.append('-')
+    return '.'.join(signature)
+
+
+def data_version():
+    return f"{_epoch}-{_version}-{external_version()}"
+
+
+def bump_after_commit(session):
+    # The engine's commit event fires before COMMIT; the session's after_commit once it has gone through
+    if getattr(_committed, 'wrote', False):
+        _committed.wrote = False
+        bump_data_version()
+
+
+def install_data_version(app):
+    global _database_files
+    database_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
+    _database_files = (database_path, database_path + '-wal')
+
+    def mark_write(connection, cursor, statement, parameters, context, executemany):
+        # text() and exec_driver_sql() carry no insert/update/delete flags, so anything but a read counts
+        if statement.lstrip()[:6].upper() not in READ_STATEMENTS:
+            connection.info['wrote'] = True
+
+    def note_commit(connection):
+        if connection.info.pop('wrote', False):
+            _committed.wrote = True
+
+    def forget_on_rollback(connection):
+        connection.info.pop('wrote', None)
+
+    with app.app_context():
+        event.listen(db.engine, 'after_cursor_execute', mark_write)
+        event.listen(db.engine, 'commit', note_commit)
+        event.listen(db.engine, 'rollback', forget_on_rollback)
+    if not event.contains(Session, 'after_commit', bump_after_commit):
+        event.listen(Session, 'after_commit', bump_after_commit)
+
+
+def page_etag():
+    # The header depends on who is asking
+    key = '|'.join((data_version(), str(session.get('user_id')), request.full_path))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def conditional_page(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        # Taken before rendering: a write that lands mid-render changes the next request's tag
+        etag = page_etag()
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # Browsers keep the page but check back every time; the check is a 304 when nothing changed
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
+
+class FragmentCache:
+    def __init__(self, ttl=FRAGMENT_CACHE_TTL, max_entries=FRAGMENT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key, render):
+        now = time.monotonic()
+        version = data_version()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                return entry[2]
+
+        value = render()
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                # Expired ones first; if none are, the oldest go
+                for stale in sorted(self.entries, key=lambda name: self.entries[name][1])[:len(self.entries) // 4 or 1]:
+                    del self.entries[stale]
+            self.entries[key] = (version, now + self.ttl, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+fragment_cache = FragmentCache()
+
+
+def render_fragment(template_name, **context):
+    return Markup(render_template(template_name, **context))
+
+
+def cached_fragment(key, render):
+    ttl = current_app.config.get('FRAGMENT_CACHE_TTL', FRAGMENT_CACHE_TTL)
+    if not ttl:
+        return render()
+    fragment_cache.ttl = ttl
+    return fragment_cache.get(key, render)
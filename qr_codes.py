@@ -0,0 +1,281 @@
+import datetime
+import hashlib
+import io
+import math
+import os
+import threading
+import zipfile
+from concurrent.futures import as_completed
+from sqlalchemy import update
+from models import db, Tool
+from qr_tokens import get_signing_key, new_token, qr_payload
+from workers import get_process_pool
+
+# Bump when the rendering below changes so every label is redrawn once
+RENDER_VERSION = 2
+UPDATE_BATCH_SIZE = 500
+
+
+def qr_filename(tool_id, name, location):
+    return f"{name}_{tool_id}_{location.replace(' ', '_')}_QRcode.png"
+
+
+def content_hash(tool_id, name, location, token):
+    raw = f"{RENDER_VERSION}|{tool_id}|{name}|{location}|{token}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def render_qr_code(path, data):
+    # Imported here so starting the app does not load the image libraries
+    import qrcode
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill='black', back_color='white')
+    img.save(path)
+    return path
+
+
+def plan_label(row, qr_code_dir, signing_key, force=False):
+    token = new_token() if force or not row.qr_token else row.qr_token
+    digest = content_hash(row.id, row.name, row.location, token)
+    path = os.path.join(qr_code_dir, qr_filename(row.id, row.name, row.location))
+    # Unchanged name, location and token, and the PNG is still on disk: nothing to do
+    if not force and digest == row.qr_hash and row.qr_code == path and os.path.exists(path):
+        return None
+    return {
+        'id': row.id,
+        'qr_token': token,
+        'qr_hash': digest,
+        'qr_code': path,
+        'old_qr_code': row.qr_code,
+        'data': qr_payload(signing_key, row.id, token),
+    }
+
+
+class QRRegenerationJob(threading.Thread):
+    def __init__(self, app, force=False, workers=None):
+        super().__init__(name='qr-regeneration', daemon=True)
+        self.app = app
+        self.force = force
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.progress = {
+            'state': 'pending',
+            'force': force,
+            'total': 0,
+            'done': 0,
+            'skipped': 0,
+            'failed': 0,
+            'started': None,
+            'finished': None,
+            'error': None,
+        }
+
+    def status(self):
+        with self.lock:
+            return dict(self.progress)
+
+    def update_progress(self, **changes):
+        with self.lock:
+            for key, value in changes.items():
+                if key in ('done', 'skipped', 'failed'):
+                    self.progress[key] += value
+                else:
+                    self.progress[key] = value
+
+    def run(self):
+        self.update_progress(state='running', started=datetime.datetime.now())
+        try:
+            with self.app.app_context():
+                self.regenerate()
+            self.update_progress(state='finished')
+        except Exception as e:
+            self.update_progress(state='failed', error=str(e))
+            raise
+        finally:
+            self.update_progress(finished=datetime.datetime.now())
+
+    def regenerate(self):
+        qr_code_dir = self.app.config['QR_CODES_PATH']
+        os.makedirs(qr_code_dir, exist_ok=True)
+        signing_key = get_signing_key(self.app)
+        rows = db.session.query(Tool.id, Tool.name, Tool.location, Tool.qr_code, Tool.qr_token, Tool.qr_hash).all()
+        db.session.remove()
+
+        plans = {}
+        skipped = 0
+        for row in rows:
+            plan = plan_label(row, qr_code_dir, signing_key, self.force)
+            if plan is None:
+                skipped += 1
+            else:
+                plans[plan['id']] = plan
+        self.update_progress(total=len(rows), skipped=skipped)
+        if not plans:
+            return
+
+        pool = get_process_pool('qr_render', self.workers)
+        futures = {pool.submit(render_qr_code, plan['qr_code'], plan['data']): plan['id'] for plan in plans.values()}
+        pending = []
+        for future in as_completed(futures):
+            plan = plans[futures[future]]
+            try:
+                future.result()
+            except OSError as e:
+                print(f"Could not render QR code for tool {plan['id']}: {e}")
+                self.update_progress(failed=1)
+                continue
+            pending.append(plan)
+            self.update_progress(done=1)
+            if len(pending) >= UPDATE_BATCH_SIZE:
+                self.save(pending)
+                pending = []
+        self.save(pending)
+
+    def save(self, plans):
+        if not plans:
+            return
+        # ORM bulk UPDATE by primary key: one executemany per batch
+        db.session.execute(update(Tool), [
+            {'id': plan['id'], 'qr_code': plan['qr_code'], 'qr_token': plan['qr_token'], 'qr_hash': plan['qr_hash']}
+            for plan in plans
+        ])
+        db.session.commit()
+        for plan in plans:
+            old_path = plan['old_qr_code']
+            if old_path and old_path != plan['qr_code'] and os.path.exists(old_path):
+                os.remove(old_path)
+
+
+_job = None
+_job_lock = threading.Lock()
+
+
+def start_regeneration(app, force=False):
+    global _job
+    with _job_lock:
+        if _job is not None and _job.is_alive():
+            return _job, False
+        _job = QRRegenerationJob(app, force=force, workers=app.config.get('QR_RENDER_WORKERS'))
+        _job.start()
+        return _job, True
+
+
+def get_regeneration_status():
+    return _job.status() if _job is not None else None
+
+
+def select_tools(location=None, id_from=None, id_to=None, tool_ids=None):
+    query = db.session.query(Tool.id, Tool.name, Tool.location, Tool.qr_code)
+    if location:
+        query = query.filter(Tool.location == location)
+    if id_from is not None:
+        query = query.filter(Tool.id >= id_from)
+    if id_to is not None:
+        query = query.filter(Tool.id <= id_to)
+    if tool_ids:
+        query = query.filter(Tool.id.in_(tool_ids))
+    return query.order_by(Tool.id).all()
+
+
+class StreamBuffer(io.RawIOBase):
+    # Write-only, unseekable sink: zipfile then writes data descriptors instead of seeking back
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries):
+    buffer = StreamBuffer()
+    # PNGs are already deflated; storing them saves CPU and loses nothing
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, content in entries:
+            if isinstance(content, bytes):
+                archive.writestr(name, content)
+            else:
+                archive.write(content, name)
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def iter_label_files(tools):
+    for tool in tools:
+        if tool.qr_code and os.path.exists(tool.qr_code):
+            yield os.path.basename(tool.qr_code), tool.qr_code
+
+
+def stream_qr_zip(tools):
+    return stream_zip(iter_label_files(tools))
+
+
+def draw_label_sheet(labels, columns, rows, dpi):
+    from PIL import Image, ImageDraw, ImageFont
+    # A4 portrait
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    margin = int(0.4 * dpi)
+    cell_width = (width - 2 * margin) // columns
+    cell_height = (height - 2 * margin) // rows
+    caption_height = max(12, cell_height // 8)
+    qr_size = min(cell_width, cell_height - caption_height) - int(0.1 * dpi)
+    try:
+        font = ImageFont.load_default(size=caption_height * 2 // 3)
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+
+    sheet = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(sheet)
+    for index, (caption, path) in enumerate(labels):
+        column, row = index % columns, index // columns
+        left = margin + column * cell_width
+        top = margin + row * cell_height
+        with Image.open(path) as img:
+            # Nearest keeps QR modules crisp when scaling
+            qr_img = img.convert('L').resize((qr_size, qr_size), Image.NEAREST)
+        sheet.paste(qr_img, (left + (cell_width - qr_size) // 2, top))
+        text_left, text_top, text_right, text_bottom = draw.textbbox((0, 0), caption, font=font)
+        draw.text((left + (cell_width - (text_right - text_left)) // 2,
+                   top + qr_size + (caption_height - (text_bottom - text_top)) // 2),
+                  caption, fill=0, font=font)
+
+    output = io.BytesIO()
+    sheet.save(output, format='PNG', dpi=(dpi, dpi), optimize=False)
+    return output.getvalue()
+
+
+def iter_label_sheets(tools, columns=4, rows=6, dpi=300):
+    per_page = columns * rows
+    labels = [(f"{tool.name} (#{tool.id})", tool.qr_code) for tool in tools
+              if tool.qr_code and os.path.exists(tool.qr_code)]
+    pages = math.ceil(len(labels) / per_page)
+    # Only one page is ever held in memory
+    for page in range(pages):
+        chunk = labels[page * per_page:(page + 1) * per_page]
+        yield f"labels_page_{page + 1:03d}.png", draw_label_sheet(chunk, columns, rows, dpi)
+
+
+def stream_label_sheets(tools, columns=4, rows=6, dpi=300):
+    return stream_zip(iter_label_sheets(tools, columns, rows, dpi))
@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from models import Tool
+
+PAYLOAD_PREFIX = 'TT'
+SIGNATURE_BYTES = 12
+SIGNING_KEY_FILE = 'qr_signing.key'
+
+_key_lock = threading.Lock()
+
+
+def new_token():
+    return secrets.token_urlsafe(12)
+
+
+def load_signing_key(path):
+    with _key_lock:
+        if not os.path.exists(path):
+            # Made once per installation and kept next to the TLS key; printed labels depend on it
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+        with open(path) as f:
+            return f.read().strip()
+
+
+def get_signing_key(app):
+    key = app.config.get('QR_SIGNING_KEY')
+    if not key:
+        path = app.config.get('QR_SIGNING_KEY_PATH') or os.path.join(app.config['CERTS_PATH'], SIGNING_KEY_FILE)
+        key = app.config['QR_SIGNING_KEY'] = load_signing_key(path)
+    return key.encode('utf-8') if isinstance(key, str) else key
+
+
+def sign(key, tool_id, token):
+    digest = hmac.new(key, f"{tool_id}:{token}".encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode('ascii')
+
+
+def qr_payload(key, tool_id, token):
+    return f"{PAYLOAD_PREFIX}:{tool_id}:{token}:{sign(key, tool_id, token)}"
+
+
+def parse_payload(payload, key):
+    parts = payload.strip().split(':')
+    # Labels printed before signing carry no token on record and have to be regenerated
+    if len(parts) != 4 or parts[0] != PAYLOAD_PREFIX:
+        return None
+    _, tool_id, token, signature = parts
+    if not tool_id.isdigit():
+        return None
+    # compare_digest: forged labels learn nothing from response timing
+    if not hmac.compare_digest(signature, sign(key, tool_id, token)):
+        return None
+    return int(tool_id), token
+
+
+def lookup_tokens(tokens):
+    if not tokens:
+        return {}
+    return {tool.qr_token: tool for tool in Tool.query.filter(Tool.qr_token.in_(tokens))}
+
+
+def check_tool(parsed, tools_by_token):
+    if parsed is None:
+        return None, 'invalid'
+    tool_id, token = parsed
+    tool = tools_by_token.get(token)
+    # A regenerated (re-keyed) label replaced the token, so the old one finds nothing
+    if tool is None or tool.id != tool_id:
+        return None, 'revoked'
+    return tool, 'ok'
+
+
+def verify_scan(payload, key):
+    parsed = parse_payload(payload, key)
+    if parsed is None:
+        return None, 'invalid'
+    return check_tool(parsed, lookup_tokens([parsed[1]]))
@@ -0,0 +1,158 @@
+import datetime
+import os
+import threading
+from sqlalchemy import delete, func, insert, literal, or_, select
+from models import db, Tool, User, Transaction, TransactionArchive
+from auth import invalidate_user_roles
+from api_tokens import revoke_api_tokens
+
+# Stays well below SQLite's bound-parameter limit on older builds (999)
+REMOVE_CHUNK_SIZE = 500
+TRANSACTION_POLICIES = ('archive', 'block')
+
+
+def parse_id_spec(text):
+    ids, ranges = [], []
+    for part in (text or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                start, end = (int(value) for value in part.split('-', 1))
+                if start > end:
+                    raise ValueError
+                ranges.append((start, end))
+            else:
+                ids.append(int(part))
+        except ValueError:
+            raise ValueError(f"Invalid id or range: {part}")
+    return ids, ranges
+
+
+def chunks(values, size=REMOVE_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def id_condition(column, ids, ranges):
+    conditions = [column.between(start, end) for start, end in ranges]
+    if ids:
+        conditions.append(column.in_(ids))
+    return or_(*conditions)
+
+
+def select_targets(model, columns, ids=(), ranges=(), location=None):
+    if not ids and not ranges and not location:
+        raise ValueError("Select what to remove by id, id range or location.")
+    query = db.session.query(*columns)
+    if ids or ranges:
+        query = query.filter(id_condition(model.id, ids, ranges))
+    if location:
+        query = query.filter(Tool.location == location)
+    return query.order_by(model.id).all()
+
+
+def find_loans(loan_column, ids):
+    loans = {}
+    for chunk in chunks(ids):
+        # count(return_date) skips open loans, so the difference is the open ones
+        rows = db.session.query(loan_column, func.count(), func.count(Transaction.return_date)) \
+            .filter(loan_column.in_(chunk)) \
+            .group_by(loan_column)
+        for target_id, total, closed in rows:
+            loans[target_id] = (total - closed, total)
+    return loans
+
+
+def archive_loans(loan_column, chunk, now):
+    source = select(Transaction.user_id, User.username, Transaction.tool_id, Tool.name,
+                    Transaction.borrow_date, Transaction.return_date, literal(now)) \
+        .select_from(Transaction) \
+        .outerjoin(User, Transaction.user_id == User.id) \
+        .outerjoin(Tool, Transaction.tool_id == Tool.id) \
+        .where(loan_column.in_(chunk))
+    archived = db.session.execute(insert(TransactionArchive).from_select(
+        ['user_id', 'username', 'tool_id', 'tool_name', 'borrow_date', 'return_date', 'archived_at'], source))
+    db.session.execute(delete(Transaction).where(loan_column.in_(chunk)),
+                       execution_options={'synchronize_session': False})
+    return archived.rowcount
+
+
+def remove_targets(model, loan_column, targets, on_transactions, keep_ids=()):
+    if on_transactions not in TRANSACTION_POLICIES:
+        raise ValueError(f"Unknown transaction policy: {on_transactions}")
+
+    loans = find_loans(loan_column, [target.id for target in targets])
+    removable = []
+    blocked = []
+    for target in targets:
+        open_loans, total_loans = loans.get(target.id, (0, 0))
+        if target.id in keep_ids:
+            blocked.append((target, 'is the account you are logged in with'))
+        elif open_loans:
+            # An open loan means the tool is physically out; never drop that record
+            blocked.append((target, f'has {open_loans} open loan(s)'))
+        elif total_loans and on_transactions == 'block':
+            blocked.append((target, f'has {total_loans} loan(s) on record'))
+        else:
+            removable.append(target)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    archived = 0
+    try:
+        # Every chunk goes into one transaction: either all of them are removed or none
+        for chunk in chunks([target.id for target in removable]):
+            archived += archive_loans(loan_column, chunk, now)
+            db.session.execute(delete(model).where(model.id.in_(chunk)),
+                               execution_options={'synchronize_session': False})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    # Objects loaded earlier in this session may point at rows that are gone now
+    db.session.expire_all()
+    return removable, blocked, archived
+
+
+def delete_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Could not delete {path}: {e}")
+
+
+def delete_files_later(paths):
+    if not paths:
+        return None
+    thread = threading.Thread(target=delete_files, args=(paths,), name='file-cleanup', daemon=True)
+    thread.start()
+    return thread
+
+
+def removal_result(removed, blocked, archived, label):
+    return {
+        'removed': [{'id': target.id, 'name': getattr(target, label)} for target in removed],
+        'blocked': [{'id': target.id, 'name': getattr(target, label), 'reason': reason} for target, reason in blocked],
+        'archived_transactions': archived,
+    }
+
+
+def delete_tools(ids=(), ranges=(), location=None, on_transactions='archive'):
+    targets = select_targets(Tool, (Tool.id, Tool.name, Tool.qr_code), ids, ranges, location)
+    removed, blocked, archived = remove_targets(Tool, Transaction.tool_id, targets, on_transactions)
+    # The rows are gone already; the label files can disappear at their own pace
+    delete_files_later([tool.qr_code for tool in removed if tool.qr_code])
+    return removal_result(removed, blocked, archived, 'name')
+
+
+def delete_users(ids=(), ranges=(), on_transactions='archive', keep_ids=()):
+    targets = select_targets(User, (User.id, User.username), ids, ranges)
+    removed, blocked, archived = remove_targets(User, Transaction.user_id, targets, on_transactions, keep_ids)
+    for user in removed:
+        invalidate_user_roles(user.id)
+    revoke_api_tokens(user_ids=[user.id for user in removed])
+    return removal_result(removed, blocked, archived, 'username')
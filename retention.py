@@ -0,0 +1,169 @@
+import datetime
+import os
+import re
+import threading
+from flask import current_app
+from sqlalchemy import MetaData, create_engine, delete, func, insert, literal, select
+from sqlalchemy.pool import NullPool
+from models import db, Tool, User, Transaction, ToolLog, TransactionArchive
+from page_cache import bump_data_version
+
+ARCHIVE_NAME = re.compile(r'^history_(\d{4})_(\d{2})\.db$')
+
+# The same tables as the live database, under the schema name the archive file is attached as
+archive_metadata = MetaData()
+archived_logs = ToolLog.__table__.to_metadata(archive_metadata, schema='archive')
+archived_transactions = TransactionArchive.__table__.to_metadata(archive_metadata, schema='archive')
+
+_engines = {}
+_engines_lock = threading.Lock()
+# Held while loans move into monthly files, and by readers that must not see them half moved
+history_lock = threading.Lock()
+
+
+def get_archive_path(app=None):
+    archive_path = (app or current_app).config['ARCHIVE_PATH']
+    os.makedirs(archive_path, exist_ok=True)
+    return archive_path
+
+
+def next_month(value):
+    return datetime.datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def archive_file(archive_path, month):
+    return os.path.join(archive_path, f'history_{month:%Y_%m}.db')
+
+
+def list_archives(app=None):
+    archives = []
+    archive_path = get_archive_path(app)
+    for name in os.listdir(archive_path):
+        match = ARCHIVE_NAME.match(name)
+        if match:
+            start = datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+            archives.append((start, next_month(start), os.path.join(archive_path, name)))
+    # Newest month first, the order log pages are read in
+    return sorted(archives, reverse=True)
+
+
+def get_archive_engine(path):
+    with _engines_lock:
+        if path not in _engines:
+            _engines[path] = create_engine(f'sqlite:///{path}', poolclass=NullPool)
+        return _engines[path]
+
+
+def find_archives(start=None, end=None, before=None, app=None):
+    # Without a start date the hot table answers alone: archives are only read when a range asks for them
+    if start is None:
+        return []
+    start = start.replace(tzinfo=None)
+    end = end.replace(tzinfo=None) if end else None
+    before = before.replace(tzinfo=None) if before else None
+    return [(month, month_end, path) for month, month_end, path in list_archives(app)
+            if month_end > start and (end is None or month < end) and (before is None or month <= before)]
+
+
+def naive_utc(value):
+    # Timestamps are stored as naive UTC
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def months_to_archive(column, condition):
+    months = db.session.query(func.strftime('%Y-%m', column)).filter(condition).distinct().all()
+    return sorted(datetime.datetime.strptime(month, '%Y-%m') for month, in months if month)
+
+
+def archive_month(connection, archive_path, month, log_condition, transaction_condition, now):
+    month_end = next_month(month)
+    path = archive_file(archive_path, month)
+    # ATTACH lets one statement copy the rows without pulling them through Python
+    connection.exec_driver_sql('ATTACH DATABASE ? AS archive', (path,))
+    connection.commit()
+    try:
+        with connection.begin():
+            archive_metadata.create_all(connection)
+
+            in_month = (ToolLog.timestamp >= month) & (ToolLog.timestamp < month_end)
+            # OR IGNORE keeps a re-run after an interrupted pass from failing on rows already copied
+            logs = connection.execute(insert(archived_logs).prefix_with('OR IGNORE').from_select(
+                [column.name for column in ToolLog.__table__.columns],
+                select(*ToolLog.__table__.columns).where(log_condition, in_month)))
+            connection.execute(delete(ToolLog.__table__).where(log_condition, in_month))
+
+            in_month = (Transaction.borrow_date >= month) & (Transaction.borrow_date < month_end)
+            source = select(Transaction.id, Transaction.user_id, User.username, Transaction.tool_id, Tool.name,
+                            Transaction.borrow_date, Transaction.return_date, literal(now)) \
+                .select_from(Transaction) \
+                .outerjoin(User, Transaction.user_id == User.id) \
+                .outerjoin(Tool, Transaction.tool_id == Tool.id) \
+                .where(transaction_condition, in_month)
+            transactions = connection.execute(insert(archived_transactions).prefix_with('OR IGNORE').from_select(
+                ['id', 'user_id', 'username', 'tool_id', 'tool_name', 'borrow_date', 'return_date', 'archived_at'],
+                source))
+            connection.execute(delete(Transaction.__table__).where(transaction_condition, in_month))
+    finally:
+        connection.exec_driver_sql('DETACH DATABASE archive')
+        connection.commit()
+    return logs.rowcount, transactions.rowcount
+
+
+def archive_history(app, older_than_days=None):
+    days = older_than_days if older_than_days is not None else app.config.get('LOG_RETENTION_DAYS')
+    if not days:
+        return {'logs': 0, 'transactions': 0, 'months': []}
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cutoff = naive_utc(now) - datetime.timedelta(days=days)
+    archive_path = get_archive_path(app)
+
+    log_condition = ToolLog.timestamp < cutoff
+    # Open loans are live data whatever their age
+    transaction_condition = Transaction.return_date.isnot(None) & (Transaction.return_date < cutoff)
+
+    with app.app_context():
+        months = sorted(set(months_to_archive(ToolLog.timestamp, log_condition))
+                        | set(months_to_archive(Transaction.borrow_date, transaction_condition)))
+        total_logs = total_transactions = 0
+        with history_lock, db.engine.connect() as connection:
+            for month in months:
+                logs, transactions = archive_month(connection, archive_path, month,
+                                                   log_condition, transaction_condition, naive_utc(now))
+                total_logs += logs
+                total_transactions += transactions
+
+    if months:
+        # Plain connection commits are not seen by the session's after_commit
+        bump_data_version()
+        print(f"Archived {total_logs} log entries and {total_transactions} loans older than {cutoff:%Y-%m-%d} "
+              f"into {len(months)} monthly file(s).")
+    return {'logs': total_logs, 'transactions': total_transactions,
+            'months': [f'{month:%Y-%m}' for month in months]}
+
+
+class RetentionScheduler(threading.Thread):
+    def __init__(self, app, interval_hours):
+        super().__init__(name='retention-scheduler', daemon=True)
+        self.app = app
+        self.interval = interval_hours * 3600
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                archive_history(self.app)
+            except Exception as e:
+                print(f"Scheduled history archival failed: {e}")
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_retention_scheduler(app):
+    interval_hours = app.config.get('RETENTION_INTERVAL_HOURS')
+    if not interval_hours or not app.config.get('LOG_RETENTION_DAYS'):
+        return None
+    scheduler = RetentionScheduler(app, interval_hours)
+    scheduler.start()
+    app.extensions['retention_scheduler'] = scheduler
+    return scheduler
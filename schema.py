@@ -0,0 +1,80 @@
+import os
+import re
+import sys
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from models import db
+
+REVISION_PATTERN = re.compile(r"^(revision|down_revision) = '([^']+)'", re.MULTILINE)
+
+
+def get_migrations_path():
+    # PyInstaller unpacks bundled data next to the executable under _MEIPASS
+    base_dir = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_dir, 'migrations')
+
+
+def get_alembic_config(app):
+    # Alembic is only needed when the schema actually changes, so it stays out of the startup path
+    from alembic.config import Config
+    config = Config()
+    config.set_main_option('script_location', get_migrations_path())
+    config.set_main_option('sqlalchemy.url', app.config['SQLALCHEMY_DATABASE_URI'].replace('%', '%%'))
+    return config
+
+
+def get_current_revision():
+    try:
+        with db.engine.connect() as connection:
+            return connection.execute(text('SELECT version_num FROM alembic_version')).scalar()
+    except OperationalError:
+        return None
+
+
+def get_head_revision(app):
+    from alembic.script import ScriptDirectory
+    return ScriptDirectory.from_config(get_alembic_config(app)).get_current_head()
+
+
+def read_head_revision():
+    # Plain text scan of the version scripts; the history is linear, so the head is
+    # the one revision nothing else revises
+    versions_path = os.path.join(get_migrations_path(), 'versions')
+    revisions, parents = set(), set()
+    for name in os.listdir(versions_path):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(versions_path, name), encoding='utf-8') as f:
+            for key, value in REVISION_PATTERN.findall(f.read()):
+                (revisions if key == 'revision' else parents).add(value)
+    heads = revisions - parents
+    return heads.pop() if len(heads) == 1 else None
+
+
+def upgrade_database(app, revision='head'):
+    with app.app_context():
+        current = get_current_revision()
+        if revision == 'head' and current is not None and current == read_head_revision():
+            return
+
+        from alembic import command
+        config = get_alembic_config(app)
+        head = get_head_revision(app)
+        if revision == 'head' and current == head:
+            return
+
+        print(f"Upgrading database schema from {current or 'unversioned'} to {revision if revision != 'head' else head}...")
+        with db.engine.begin() as connection:
+            config.attributes['connection'] = connection
+            command.upgrade(config, revision)
+        print("Database schema is up to date.")
+
+
+def downgrade_database(app, revision):
+    from alembic import command
+    config = get_alembic_config(app)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            config.attributes['connection'] = connection
+            command.downgrade(config, revision)
+        print(f"Database schema downgraded to {revision}.")
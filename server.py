@@ -0,0 +1,51 @@
+import os
+from cheroot import wsgi
+from cheroot.ssl.builtin import BuiltinSSLAdapter
+
+
+def get_certificate_paths(app):
+    certs_path = app.config['CERTS_PATH']
+    certificate_path = os.path.join(certs_path, 'certificate.pem')
+    key_path = os.path.join(certs_path, 'key.pem')
+    if os.path.exists(certificate_path) and os.path.exists(key_path):
+        return certificate_path, key_path
+    return None
+
+
+def create_server(app, host=None, port=None, threads=None, timeout=None, keep_alive_connections=None):
+    host = host or app.config['SERVER_HOST']
+    port = port or app.config['SERVER_PORT']
+    threads = threads or app.config['SERVER_THREADS']
+
+    # Threads rather than processes: the live log stream, the QR job status and
+    # the SQLite write lock all live in this one process
+    server = wsgi.Server(
+        (host, port),
+        app,
+        numthreads=threads,
+        max=threads,
+        request_queue_size=app.config['SERVER_BACKLOG'],
+        timeout=timeout or app.config['SERVER_TIMEOUT'],
+        shutdown_timeout=app.config['SERVER_SHUTDOWN_TIMEOUT'],
+    )
+    # Idle keep-alive connections wait in a selector, not in a worker thread
+    server.keep_alive_conn_limit = (keep_alive_connections if keep_alive_connections is not None
+                                    else app.config['SERVER_KEEP_ALIVE_CONNECTIONS'])
+
+    certificates = get_certificate_paths(app)
+    if certificates:
+        server.ssl_adapter = BuiltinSSLAdapter(*certificates)
+    else:
+        print(f"No certificate found in {app.config['CERTS_PATH']}, serving plain HTTP.")
+    print(f"Serving on {'https' if certificates else 'http'}://{host}:{port} with {threads} threads")
+    return server
+
+
+def serve(app, **options):
+    server = create_server(app, **options)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
@@ -0,0 +1,38 @@
+document.addEventListener("DOMContentLoaded", function() {
+    const coll = document.getElementsByClassName("collapsible");
+    const content = document.getElementsByClassName("content");
+    const openIndex = localStorage.getItem('openCollapsible');
+
+    if (openIndex !== null) {
+        coll[openIndex].classList.add("active");
+        content[openIndex].style.display = "block";
+        content[openIndex].classList.add('show');
+    }
+
+    for (let i = 0; i < coll.length; i++) {
+        coll[i].addEventListener("click", function() {
+            this.classList.toggle("active");
+            let content = this.nextElementSibling;
+            if (content.style.display === "block") {
+                content.style.display = "none";
+                content.classList.remove('show');
+                localStorage.removeItem('openCollapsible');
+            } else {
+                content.style.display = "block";
+                content.classList.add('show');
+                localStorage.setItem('openCollapsible', i);
+            }
+        });
+    }
+
+    setTimeout(function() {
+        const alerts = document.querySelectorAll('.alert');
+        alerts.forEach(function(alert) {
+            alert.classList.remove('show');
+        });
+    }, 10000);
+
+    $('.select2').select2({
+        width: '100%'
+    });
+});
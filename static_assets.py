@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+import urllib.request
+from flask import abort, current_app, send_from_directory
+from werkzeug.security import safe_join
+
+# Pinned CDN builds, downloaded once next to the database so kiosks never need the internet
+VENDOR_ASSETS = {
+    'vendor/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@4.5.2/dist/css/bootstrap.min.css',
+    'vendor/bootstrap.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@4.5.2/dist/js/bootstrap.min.js',
+    'vendor/select2.min.css': 'https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/css/select2.min.css',
+    'vendor/select2.min.js': 'https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/js/select2.min.js',
+    'vendor/jquery.min.js': 'https://cdn.jsdelivr.net/npm/jquery@3.6.0/dist/jquery.min.js',
+    'vendor/popper.min.js': 'https://cdn.jsdelivr.net/npm/@popperjs/core@2.5.4/dist/umd/popper.min.js',
+    'vendor/jsQR.js': 'https://cdn.jsdelivr.net/npm/jsqr@1.4.0/dist/jsQR.js',
+}
+ASSET_MAX_AGE = 365 * 24 * 3600
+FINGERPRINT_LENGTH = 12
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def asset_directories(app):
+    # Files shipped with the app first, then the downloaded vendor builds
+    return (app.static_folder, app.config['STATIC_ASSETS_PATH'])
+
+
+def find_asset(app, name):
+    for directory in asset_directories(app):
+        path = safe_join(directory, name)
+        if path is not None and os.path.isfile(path):
+            return directory, path
+    return None, None
+
+
+def fingerprint(path):
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _fingerprints_lock:
+        if key in _fingerprints:
+            return _fingerprints[key]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:FINGERPRINT_LENGTH]
+    with _fingerprints_lock:
+        _fingerprints[key] = digest
+    return digest
+
+
+def asset_url(name):
+    directory, path = find_asset(current_app, name)
+    if path is None:
+        # Not downloaded yet: the CDN copy still works while online
+        return VENDOR_ASSETS.get(name, f'/static/{name}')
+    return f'/assets/{fingerprint(path)}/{name}'
+
+
+def serve_asset(digest, name):
+    directory, path = find_asset(current_app, name)
+    if path is None:
+        abort(404)
+    current = fingerprint(path) == digest
+    # The fingerprint changes with the content, so a matching URL can be cached for good
+    response = send_from_directory(directory, name, max_age=ASSET_MAX_AGE if current else 0)
+    if current:
+        response.cache_control.immutable = True
+    return response
+
+
+def download_vendor_assets(assets_path):
+    for name, url in VENDOR_ASSETS.items():
+        path = os.path.join(assets_path, name)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        request = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            content = response.read()
+        # Written under a temporary name so a broken download is never served
+        with open(path + '.part', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.part', path)
+    print("Web page assets are stored locally.")
+
+
+def missing_vendor_assets(assets_path):
+    return [name for name in VENDOR_ASSETS if not os.path.exists(os.path.join(assets_path, name))]
+
+
+def install_static_assets(app, start_task):
+    app.add_url_rule('/assets/<digest>/<path:name>', 'asset', serve_asset)
+    app.jinja_env.globals['asset_url'] = asset_url
+    assets_path = app.config['STATIC_ASSETS_PATH']
+    if missing_vendor_assets(assets_path):
+        return start_task('asset-download', download_vendor_assets, assets_path)
+    return None
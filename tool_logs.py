@@ -0,0 +1,128 @@
+import base64
+import datetime
+from sqlalchemy import and_, or_, select
+from models import ToolLog
+from retention import find_archives, get_archive_engine
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+LOG_FILTERS = ('user', 'tool', 'action', 'start', 'end')
+LOG_COLUMNS = (ToolLog.id, ToolLog.timestamp, ToolLog.username, ToolLog.tool_name, ToolLog.action, ToolLog.details)
+
+
+def encode_cursor(log):
+    raw = f"{log.timestamp.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, log_id = raw.rsplit('|', 1)
+        return datetime.datetime.fromisoformat(timestamp), int(log_id)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def parse_date(value, end=False):
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid date: {value}") from e
+    # A bare date as the end of a range means "up to the end of that day"
+    if end and len(value) == 10:
+        parsed += datetime.timedelta(days=1)
+    return parsed
+
+
+def parse_log_filters(args):
+    filters = {key: args.get(key, '').strip() for key in LOG_FILTERS}
+    filters = {key: value for key, value in filters.items() if value}
+    if 'start' in filters:
+        filters['start'] = parse_date(filters['start'])
+    if 'end' in filters:
+        filters['end'] = parse_date(filters['end'], end=True)
+    return filters
+
+
+def parse_limit(value, default=PAGE_SIZE):
+    try:
+        limit = int(value) if value else default
+    except ValueError:
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def filter_logs(query, user=None, tool=None, action=None, start=None, end=None):
+    if user:
+        query = query.filter(ToolLog.username == user)
+    if tool:
+        query = query.filter(ToolLog.tool_name == tool)
+    if action:
+        query = query.filter(ToolLog.action == action.upper())
+    if start:
+        query = query.filter(ToolLog.timestamp >= start)
+    if end:
+        query = query.filter(ToolLog.timestamp < end)
+    return query
+
+
+def after_cursor(query, cursor):
+    timestamp, log_id = decode_cursor(cursor)
+    # The plain <= bound lets SQLite range-scan ix_tool_log_timestamp; the OR breaks ties on id
+    return query.filter(
+        ToolLog.timestamp <= timestamp,
+        or_(ToolLog.timestamp < timestamp, and_(ToolLog.timestamp == timestamp, ToolLog.id < log_id)),
+    )
+
+
+def get_archived_logs(limit, cursor=None, **filters):
+    before = decode_cursor(cursor)[0] if cursor else None
+    logs = []
+    for month, month_end, path in find_archives(filters.get('start'), filters.get('end'), before):
+        # Archive files hold a tool_log table of their own, so the same statement runs against them
+        statement = filter_logs(select(*LOG_COLUMNS), **filters)
+        if cursor:
+            statement = after_cursor(statement, cursor)
+        statement = statement.order_by(ToolLog.timestamp.desc(), ToolLog.id.desc()).limit(limit - len(logs))
+        with get_archive_engine(path).connect() as connection:
+            logs += connection.execute(statement).all()
+        if len(logs) >= limit:
+            break
+    return logs
+
+
+def get_logs_page(cursor=None, limit=PAGE_SIZE, **filters):
+    query = filter_logs(ToolLog.query, **filters)
+    if cursor:
+        query = after_cursor(query, cursor)
+    logs = query.order_by(ToolLog.timestamp.desc(), ToolLog.id.desc()).limit(limit + 1).all()
+    if len(logs) <= limit:
+        # Everything archived is older than what is left in the hot table, so archives just continue the page
+        logs += get_archived_logs(limit + 1 - len(logs), cursor, **filters)
+
+    next_cursor = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_cursor = encode_cursor(logs[-1])
+    return logs, next_cursor
+
+
+def iter_logs(batch_size=MAX_PAGE_SIZE, **filters):
+    cursor = None
+    while True:
+        logs, cursor = get_logs_page(cursor=cursor, limit=batch_size, **filters)
+        yield from logs
+        if cursor is None:
+            break
+
+
+def log_to_dict(log):
+    return {
+        'id': log.id,
+        'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'user': log.username,
+        'tool': log.tool_name,
+        'action': log.action,
+        'details': log.details if log.details else "None",
+    }
@@ -0,0 +1,96 @@
+import base64
+import re
+from sqlalchemy import and_, literal_column, or_, select, table, text
+from models import db, Tool
+
+SEARCH_LIMIT = 25
+MAX_SEARCH_LIMIT = 200
+AVAILABILITY_FILTERS = ('all', 'available', 'lent')
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+_fts_available = None
+
+
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tool_fts'")
+        ).first() is not None
+    return _fts_available
+
+
+def encode_cursor(tool):
+    raw = f"{tool.name}|{tool.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        name, tool_id = raw.rsplit('|', 1)
+        return name, int(tool_id)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def parse_search_limit(value):
+    try:
+        limit = int(value) if value else SEARCH_LIMIT
+    except ValueError:
+        limit = SEARCH_LIMIT
+    return max(1, min(limit, MAX_SEARCH_LIMIT))
+
+
+def parse_availability(value):
+    value = (value or 'all').strip().lower()
+    if value not in AVAILABILITY_FILTERS:
+        raise ValueError(f"Unknown availability filter: {value}")
+    return value
+
+
+def match_expression(tokens):
+    # Every word must match as a prefix, in either column; quoting keeps FTS syntax out of user input
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def filter_search(query, tokens):
+    if not tokens:
+        return query
+    if fts_available():
+        matches = select(literal_column('rowid')).select_from(table('tool_fts')) \
+            .where(literal_column('tool_fts').op('MATCH')(match_expression(tokens)))
+        return query.filter(Tool.id.in_(matches))
+    for token in tokens:
+        pattern = f"%{token}%"
+        query = query.filter(or_(Tool.name.ilike(pattern), Tool.location.ilike(pattern)))
+    return query
+
+
+def search_tools(q='', availability='all', limit=SEARCH_LIMIT, cursor=None):
+    tokens = TOKEN_PATTERN.findall(q or '')
+    query = db.session.query(Tool.id, Tool.name, Tool.location, Tool.rented_by)
+    query = filter_search(query, tokens)
+    # rented_by is kept in step with the open loans by triggers, so no anti-join against transaction
+    if availability == 'available':
+        query = query.filter(Tool.rented_by.is_(None))
+    elif availability == 'lent':
+        query = query.filter(Tool.rented_by.isnot(None))
+    if cursor:
+        name, tool_id = decode_cursor(cursor)
+        query = query.filter(or_(Tool.name > name, and_(Tool.name == name, Tool.id > tool_id)))
+
+    # One extra row tells us whether another page exists
+    tools = query.order_by(Tool.name, Tool.id).limit(limit + 1).all()
+    next_cursor = encode_cursor(tools[limit - 1]) if len(tools) > limit else None
+    return tools[:limit], next_cursor
+
+
+def tool_to_dict(tool):
+    return {
+        'id': tool.id,
+        'name': tool.name,
+        'location': tool.location,
+        'rented_by': tool.rented_by,
+        'available': tool.rented_by is None,
+    }
@@ -1,57 +1,68 @@
-import qrcode
-import random
-import string
 import os
 import datetime
-from io import BytesIO
-import zipfile
-import logging
-from flask import send_file
-from models import db, Tool, User, Transaction, ToolLog
+from models import db, Tool, User, Transaction
+from audit import build_log_values, record_events
+from auth import invalidate_user_roles, is_admin
+from api_tokens import create_api_token
+from analytics import Loan, rebuild_usage_rollups, record_returns
+from availability import invalidate_availability, reconcile_availability
+from importer import import_file
+from removal import delete_tools, delete_users
+from backups import create_backup, restore_backup
+from retention import archive_history
+from qr_scan import scan_paths
+from qr_codes import (qr_filename, content_hash, render_qr_code, start_regeneration,
+                      select_tools, stream_qr_zip)
+from qr_tokens import get_signing_key, new_token, qr_payload
 import sqlite3
-import cv2
-from pyzbar.pyzbar import decode
-from flask import request,current_app
-
-def shutdown_server():
-    func = request.environ.get('werkzeug.server.shutdown')
-    if func is None:
-        raise RuntimeError('Not running with the Werkzeug Server')
-    func()
+from flask import current_app
 
 def log_event(event_type, user, tool, duration=None):
-    now = datetime.datetime.now(datetime.timezone.utc)
-    formatted_timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
-
-    log_message = f"{formatted_timestamp} - {event_type}: User {user.username} ({user.id}) - Tool {tool.name} ({tool.id})"
-    if duration:
-        log_message += f" - Duration: {duration}"
-    print(log_message)  # Print to console for immediate feedback
-
-    log_entry = ToolLog(
-        tool_name=tool.name,
-        username=user.username,
-        action=event_type,
-        details=f"Time Lended: {duration}" if duration else None,
-        timestamp=now
-    )
-    db.session.add(log_entry)
-    db.session.commit()
+    record_events([build_log_values(event_type, user, tool, duration)])
+
+def loan_duration(borrow_date, now=None):
+    # SQLite hands datetimes back naive; they were stored as UTC
+    if borrow_date.tzinfo is None:
+        borrow_date = borrow_date.replace(tzinfo=datetime.timezone.utc)
+    return (now or datetime.datetime.now(datetime.timezone.utc)) - borrow_date
+
+def format_duration(duration_td):
+    hours, remainder = divmod(duration_td.total_seconds(), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours)}h:{int(minutes)}m:{int(seconds)}s"
 
 def log_lend_tool(user_id, tool_id):
     user = User.query.get(user_id)
     tool = Tool.query.get(tool_id)
     if user and tool:
-        tool.rented_by = user.username
+        if Transaction.query.filter_by(tool_id=tool_id, return_date=None).first():
+            print(f"Tool {tool.name} is already lent out.")
+            return
+        db.session.add(Transaction(user_id=user.id, tool_id=tool.id))
         db.session.commit()
+        invalidate_availability()
         log_event("LEND", user, tool)
 
 def reset_rented_items():
-    tools = Tool.query.filter(Tool.rented_by.isnot(None)).all()
-    for tool in tools:
-        tool.rented_by = None
+    # Closing the open loans is what frees the tools; the triggers clear rented_by
+    closed = Transaction.query.filter(Transaction.return_date.is_(None)) \
+        .update({'return_date': datetime.datetime.now(datetime.timezone.utc)}, synchronize_session=False)
     db.session.commit()
-    print("All rented items have been reset to not rented.")
+    invalidate_availability()
+    print(f"All rented items have been reset to not rented ({closed} open loan(s) closed).")
+
+def reconcile_tool_availability(dry_run=False):
+    drifted = reconcile_availability(dry_run=dry_run)
+    for tool in drifted:
+        print(f"Tool ID {tool['id']} ({tool['name']}): rented by {tool['rented_by'] or 'nobody'}, "
+              f"open loans say {tool['expected'] or 'nobody'}")
+    if not drifted:
+        print("Tool availability matches the open loans.")
+    elif dry_run:
+        print(f"{len(drifted)} tool(s) out of step; nothing changed.")
+    else:
+        print(f"{len(drifted)} tool(s) repaired.")
+    return drifted
 
 def log_return_tool(user_id, tool_id):
     user = User.query.get(user_id)
@@ -71,17 +82,15 @@ def log_return_tool(user_id, tool_id):
         print(f"Found active transaction for user ID {user_id} and tool ID {tool_id}.")
         print(f"Current return_date: {transaction.return_date.strftime('%Y-%m-%d %H:%M:%S') if transaction.return_date else 'None'}")
 
-        if transaction.borrow_date.tzinfo is None:
-            transaction.borrow_date = transaction.borrow_date.replace(tzinfo=datetime.timezone.utc)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        duration = loan_duration(transaction.borrow_date, now)
+        duration_str = format_duration(duration)
 
-        duration_td = datetime.datetime.now(datetime.timezone.utc) - transaction.borrow_date
-        hours, remainder = divmod(duration_td.total_seconds(), 3600)
-        minutes, seconds = divmod(remainder, 60)
-        duration_str = f"{int(hours)}h:{int(minutes)}m:{int(seconds)}s"
-        
-        transaction.return_date = datetime.datetime.now(datetime.timezone.utc)
-        tool.rented_by = None
+        transaction.return_date = now
+        transaction.duration_seconds = round(duration.total_seconds())
+        record_returns([Loan(tool.id, user.id, transaction.borrow_date, now, transaction.duration_seconds)])
         db.session.commit()
+        invalidate_availability()
         log_event("RETURN", user, tool, duration_str)
         print(f"Tool {tool.name} returned by {user.username}.")
         print(f"Transaction return_date after update: {transaction.return_date.strftime('%Y-%m-%d %H:%M:%S')}")
@@ -91,30 +100,19 @@ def log_return_tool(user_id, tool_id):
 
 
 def generate_qr_code(tool):
-    security_token = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
-    qr_data = f"{tool.id}:{tool.name}:{security_token}"
-    
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(qr_data)
-    qr.make(fit=True)
-    img = qr.make_image(fill='black', back_color='white')
-    
+    if not tool.qr_token:
+        tool.qr_token = new_token()
+
     qr_code_dir = current_app.config['QR_CODES_PATH']
     os.makedirs(qr_code_dir, exist_ok=True)
-    
-    qr_code_filename = f"{tool.name}_{tool.id}_{tool.location.replace(' ', '_')}_QRcode.png"
-    qr_code_path = os.path.join(qr_code_dir, qr_code_filename)
-    
-    img.save(qr_code_path)
+
+    qr_code_path = os.path.join(qr_code_dir, qr_filename(tool.id, tool.name, tool.location))
+    render_qr_code(qr_code_path, qr_payload(get_signing_key(current_app), tool.id, tool.qr_token))
+    tool.qr_hash = content_hash(tool.id, tool.name, tool.location, tool.qr_token)
     return qr_code_path
 
-def add_tool(name, location, rented_by=None):
-    new_tool = Tool(name=name, location=location, qr_code="placeholder", rented_by=rented_by)
+def add_tool(name, location):
+    new_tool = Tool(name=name, location=location, qr_code="placeholder")
     db.session.add(new_tool)
     db.session.commit()
     
@@ -124,11 +122,11 @@ def add_tool(name, location, rented_by=None):
     print(f"Tool '{name}' added with QR code.")
 
 def remove_tool(tool_id):
-    tool = db.session.get(Tool, tool_id)
-    if tool:
-        db.session.delete(tool)
-        db.session.commit()
+    result = delete_tools(ids=[tool_id])
+    if result['removed']:
         print(f"Tool ID '{tool_id}' removed.")
+    elif result['blocked']:
+        print(f"Tool ID '{tool_id}' not removed: it {result['blocked'][0]['reason']}.")
     else:
         print(f"Tool ID '{tool_id}' not found.")
 
@@ -138,25 +136,52 @@ def list_tools():
         print(f"Tool ID: {tool.id}, Name: {tool.name}, Location: {tool.location}, QR Code: {tool.qr_code}")
 
 def identify_tool_from_qr_code(file_path):
-    img = cv2.imread(file_path)
-    decoded_objects = decode(img)
-    for obj in decoded_objects:
-        qr_data = obj.data.decode('utf-8')
-        tool_id = qr_data.split(':')[0]
-        tool = db.session.get(Tool, tool_id)
-        if tool:
-            print(f"QR code corresponds to Tool ID: {tool.id}, Name: {tool.name}")
-            return tool
+    results, tool_ids = scan_paths([file_path])
+    for result in results:
+        if result['tool_id']:
+            print(f"QR code corresponds to Tool ID: {result['tool_id']}, Name: {result['tool_name']}")
+            return db.session.get(Tool, result['tool_id'])
     print("No matching tool found for this QR code.")
     return None
 
-def regenerate_qr_codes():
-    tools = Tool.query.all()
-    for tool in tools:
-        qr_code = generate_qr_code(tool)
-        tool.qr_code = qr_code
-    db.session.commit()
-    print("QR codes regenerated for all tools.")
+def identify_tools_from_images(paths):
+    results, tool_ids = scan_paths(paths, current_app.config.get('QR_DECODE_WORKERS'),
+                                   current_app.config.get('QR_MAX_DIMENSION', 1600))
+    for result in results:
+        if result['tool_id']:
+            status = f"rented by {result['rented_by']}" if result['rented_by'] else 'available'
+            print(f"{result['image']}: Tool ID {result['tool_id']}, Name: {result['tool_name']} ({status})")
+        else:
+            print(f"{result['image']}: {result['status'].replace('_', ' ')}")
+    print(f"Found {len(tool_ids)} tool(s) in {len({result['image'] for result in results})} image(s).")
+    return tool_ids
+
+def regenerate_qr_codes(force=False):
+    job, started = start_regeneration(current_app._get_current_object(), force=force)
+    if not started:
+        print("QR code regeneration is already running, waiting for it to finish...")
+    job.join()
+    status = job.status()
+    if status['state'] == 'failed':
+        print(f"QR code regeneration failed: {status['error']}")
+    else:
+        print(f"QR codes regenerated: {status['done']} rendered, {status['skipped']} unchanged, {status['failed']} failed.")
+
+def import_from_file(kind, path, dry_run=False):
+    with open(path, 'rb') as f:
+        report = import_file(kind, os.path.basename(path), f, dry_run=dry_run,
+                             workers=current_app.config.get('IMPORT_HASH_WORKERS'))
+    summary = report.to_dict()
+    for problem in summary['problems']:
+        print(f"Row {problem['row']}: {problem['message']}")
+    if summary['problems_truncated']:
+        print("...")
+    verb = 'would be imported' if dry_run else 'imported'
+    print(f"{summary['total']} row(s): {summary['imported']} {verb}, "
+          f"{summary['duplicates']} duplicate(s), {summary['invalid']} invalid.")
+    if kind == 'tools' and report.imported and not dry_run:
+        regenerate_qr_codes()
+    return report
 
 def add_user(username, password, is_admin=False):
     if User.query.filter_by(username=username).first():
@@ -166,21 +191,18 @@ def add_user(username, password, is_admin=False):
     user.set_password(password)
     db.session.add(user)
     db.session.commit()
+    invalidate_user_roles(user.id)
     print(f"User '{username}' added{' as admin' if is_admin else ''}.")
 
-def is_admin(user_id):
-    user = db.session.get(User, user_id)
-    return user.is_admin if user else False
-
 def add_admin(username, password):
     add_user(username, password, is_admin=True)
 
 def remove_user(user_id):
-    user = db.session.get(User, user_id)
-    if user:
-        db.session.delete(user)
-        db.session.commit()
+    result = delete_users(ids=[user_id])
+    if result['removed']:
         print(f"User ID '{user_id}' removed.")
+    elif result['blocked']:
+        print(f"User ID '{user_id}' not removed: it {result['blocked'][0]['reason']}.")
     else:
         print(f"User ID '{user_id}' not found.")
 
@@ -189,49 +211,44 @@ def list_users():
     for user in users:
         print(f"User ID: {user.id}, Username: {user.username}")
 
-def remove_tools(tool_ids):
-    for tool_id in tool_ids:
-        tool = Tool.query.get(tool_id)
-        if tool:
-            db.session.delete(tool)
-    db.session.commit()
+def remove_tools(tool_ids, on_transactions='archive'):
+    return delete_tools(ids=list(tool_ids), on_transactions=on_transactions)
 
-def remove_users(user_ids):
-    for user_id in user_ids:
-        user = User.query.get(user_id)
-        if user:
-            db.session.delete(user)
-    db.session.commit()
+def remove_users(user_ids, on_transactions='archive'):
+    return delete_users(ids=list(user_ids), on_transactions=on_transactions)
 
 def backup_database(app):
-    backup_dir = 'backups'
-    os.makedirs(backup_dir, exist_ok=True)
-    backup_file = os.path.join(backup_dir, f'database_backup_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}.db')
-    conn = sqlite3.connect(app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
-    with open(backup_file, 'wb') as f:
-        for line in conn.iterdump():
-            f.write(f'{line}\n'.encode('utf-8'))
-    print(f"Backup created at {backup_file}")
+    return create_backup(app)
 
 def restore_database(app, backup_file):
-    conn = sqlite3.connect(app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
-    cursor = conn.cursor()
-    with open(backup_file, 'r') as f:
-        sql = f.read()
-        cursor.executescript(sql)
-    conn.commit()
-    print(f"Database restored from {backup_file}")
-
-def generate_qr_codes_zip():
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-        tools = Tool.query.all()
-        for tool in tools:
-            qr_code_path = tool.qr_code
-            if os.path.exists(qr_code_path):
-                zip_file.write(qr_code_path, os.path.basename(qr_code_path))
-    zip_buffer.seek(0)
-    return zip_buffer
+    try:
+        restore_backup(app, backup_file)
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print(f"Restore failed: {e}")
+        return False
+    return True
+
+def archive_old_history(app, older_than_days=None):
+    result = archive_history(app, older_than_days)
+    if not result['months']:
+        print("Nothing old enough to archive.")
+    return result
+
+def rebuild_usage_statistics(app):
+    return rebuild_usage_rollups(app)
+
+def add_api_token(user_id, name):
+    try:
+        api_token, token = create_api_token(user_id, name)
+    except ValueError as e:
+        print(e)
+        return None
+    print(f"API token '{api_token.name}' for user ID {user_id}: {token}")
+    print("Copy it now; only its hash is stored.")
+    return token
+
+def generate_qr_codes_zip(**filters):
+    return stream_qr_zip(select_tools(**filters))
 
 def add_test_data():
     test_users = [
@@ -266,7 +283,7 @@ def add_test_data():
 
     for tool in rented_tools:
         tool_instance = Tool.query.filter_by(name=tool["name"]).first()
-        tool_instance.rented_by = tool["rented_by"]
-        db.session.commit()
+        user = User.query.filter_by(username=tool["rented_by"]).first()
+        log_lend_tool(user.id, tool_instance.id)
 
     print("Test data added: 3 users and 10 tools.")
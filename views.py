@@ -1,7 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from models import db, Tool, User, Transaction
-from utils import log_lend_tool, log_return_tool
-import datetime
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app
+from models import User
+from auth import get_current_user, is_admin
+from availability import get_open_loans
+from lending import checkout_tools, checkin_tools
+from page_cache import cached_fragment, conditional_page, render_fragment
+from qr_scan import scan_uploads
+from qr_tokens import get_signing_key, verify_scan
+from tool_search import parse_availability, parse_search_limit, search_tools, tool_to_dict
 
 views_bp = Blueprint('views', __name__)
 
@@ -12,25 +17,37 @@ def logout():
     return redirect(url_for('views.login'))
 
 @views_bp.route('/')
+@conditional_page
 def index():
-    borrowed_items = db.session.query(Transaction, Tool, User) \
-                               .join(Tool, Transaction.tool_id == Tool.id) \
-                               .join(User, Transaction.user_id == User.id) \
-                               .filter(Transaction.return_date.is_(None)) \
-                               .all()
-    return render_template('index.html', borrowed_items=borrowed_items)
+    borrowed_list = cached_fragment('borrowed_items', lambda: render_fragment('_borrowed_items.html',
+                                                                             borrowed_items=get_open_loans()))
+    return render_template('index.html', borrowed_list=borrowed_list)
 
 @views_bp.context_processor
 def utility_processor():
-    def is_admin(user_id):
-        user = db.session.get(User, user_id)
-        return user.is_admin if user else False
-    return dict(is_admin=is_admin)
+    return dict(is_admin=is_admin, current_user=get_current_user)
+
+def render_inventory_page():
+    tools, next_cursor = search_tools()
+    return render_fragment('_inventory_rows.html', tools=tools), next_cursor
 
 @views_bp.route('/inventory')
+@conditional_page
 def inventory():
-    tools = Tool.query.all()
-    return render_template('inventory.html', tools=tools)
+    # First page only; the search box fetches the rest from /api/tools/search
+    tool_rows, next_cursor = cached_fragment('inventory_first_page', render_inventory_page)
+    return render_template('inventory.html', tool_rows=tool_rows, next_cursor=next_cursor)
+
+@views_bp.route('/api/tools/search')
+def api_search_tools():
+    try:
+        tools, next_cursor = search_tools(q=request.args.get('q', ''),
+                                          availability=parse_availability(request.args.get('availability')),
+                                          limit=parse_search_limit(request.args.get('limit')),
+                                          cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'tools': [tool_to_dict(tool) for tool in tools], 'next_cursor': next_cursor})
 
 @views_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -48,51 +65,80 @@ def login():
             return redirect(url_for('views.lend'))
     return render_template('login.html')
 
+def scan_uploaded_images():
+    return scan_uploads(request.files.getlist('qr_images'),
+                        current_app.config.get('QR_DECODE_WORKERS'),
+                        current_app.config.get('QR_MAX_DIMENSION', 1600))
+
+def scanned_tool_ids():
+    if not any(f.filename for f in request.files.getlist('qr_images')):
+        return []
+    try:
+        results, tool_ids = scan_uploaded_images()
+    except (ValueError, OSError) as e:
+        flash(f'Could not scan images: {e}', 'danger')
+        return []
+    for result in results:
+        if not result['tool_id']:
+            flash(f"{result['image']}: {result['status'].replace('_', ' ')}", 'warning')
+    return [str(tool_id) for tool_id in tool_ids]
+
+QR_ERRORS = {
+    'invalid': 'QR code is not a valid tool label; labels printed by older versions must be regenerated',
+    'revoked': 'This QR label has been replaced, please print a new one',
+}
+
+def qr_data_tool_ids():
+    payload = request.form.get('qr_data', '').strip()
+    if not payload:
+        return []
+    tool, status = verify_scan(payload, get_signing_key(current_app))
+    if tool is None:
+        flash(QR_ERRORS[status], 'danger')
+        return []
+    return [str(tool.id)]
+
+@views_bp.route('/scan', methods=['POST'])
+def scan():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+
+    try:
+        results, tool_ids = scan_uploaded_images()
+    except (ValueError, OSError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    response = {'results': results, 'tool_ids': tool_ids}
+    action = request.form.get('action')
+    if action == 'lend':
+        response['outcomes'] = checkout_tools(session['user_id'], tool_ids)
+    elif action == 'return':
+        response['outcomes'] = checkin_tools(tool_ids)
+    return jsonify(response)
+
 @views_bp.route('/lend', methods=['GET', 'POST'])
+@conditional_page
 def lend():
     if 'user_id' not in session:
         return redirect(url_for('views.login'))
     
     if request.method == 'POST':
-        tool_ids = request.form.getlist('tool_ids')
-        user_id = session['user_id']
-        for tool_id in tool_ids:
-            active_transaction = Transaction.query.filter_by(tool_id=tool_id, return_date=None).first()
-            if active_transaction:
-                flash(f'Tool {Tool.query.get(tool_id).name} is already lent out', 'danger')
-            else:
-                transaction = Transaction(user_id=user_id, tool_id=tool_id, borrow_date=datetime.datetime.now(datetime.timezone.utc))
-                db.session.add(transaction)
-                db.session.commit()
-                log_lend_tool(user_id, tool_id)
-                flash(f'Tool {Tool.query.get(tool_id).name} lent successfully', 'success')
-
-    lent_out_tools = db.session.query(Transaction.tool_id).filter(Transaction.return_date.is_(None)).subquery()
-    available_tools = Tool.query.filter(Tool.id.not_in(lent_out_tools.select())).all()
-    borrowed_tools = db.session.query(Tool).join(Transaction).filter(Transaction.return_date.is_(None)).all()
-
-    return render_template('lend.html', tools=available_tools, borrowed_tools=borrowed_tools)
+        tool_ids = request.form.getlist('tool_ids') + qr_data_tool_ids() + scanned_tool_ids()
+        for result in checkout_tools(session['user_id'], tool_ids):
+            flash(result['message'], result['category'])
+
+    # The tool picker searches /api/tools/search as you type instead of listing every free tool
+    return render_template('lend.html', borrowed_tools=get_open_loans())
 
 @views_bp.route('/return', methods=['GET', 'POST'])
+@conditional_page
 def return_tool():
     if 'user_id' not in session:
         return redirect(url_for('views.login'))
 
     if request.method == 'POST':
-        tool_ids = request.form.getlist('tool_ids')
-        for tool_id in tool_ids:
-            tool = Tool.query.get(tool_id)
-            if tool:
-                transaction = Transaction.query.filter_by(tool_id=tool.id, return_date=None).first()
-                if transaction:
-                    log_return_tool(transaction.user_id, tool.id)
-                    flash(f'Tool {tool.name} returned successfully', 'success')
-                else:
-                    flash(f'No active lending record found for tool {tool.name}', 'danger')
-            else:
-                flash('Tool not found', 'danger')
-
-    transactions = db.session.query(Transaction, Tool).join(Tool).filter(Transaction.return_date.is_(None)).all()
-    borrowed_tools = [tool for transaction, tool in transactions]
-
-    return render_template('return.html', transactions=transactions, borrowed_tools=borrowed_tools)
+        tool_ids = request.form.getlist('tool_ids') + qr_data_tool_ids() + scanned_tool_ids()
+        for result in checkin_tools(tool_ids):
+            flash(result['message'], result['category'])
+
+    return render_template('return.html', borrowed_tools=get_open_loans())
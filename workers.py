@@ -0,0 +1,22 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_process_pool(purpose, workers=None):
+    # One pool per purpose, so QR_DECODE_WORKERS, QR_RENDER_WORKERS and IMPORT_HASH_WORKERS each apply
+    with _pools_lock:
+        pool = _pools.get(purpose)
+        if pool is None:
+            pool = _pools[purpose] = ProcessPoolExecutor(max_workers=workers)
+        return pool
+
+
+def shutdown_process_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(cancel_futures=True)